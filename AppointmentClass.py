@@ -1,121 +1,295 @@
-from tkinter import messagebox
-import pandas as pd
-from datetime import datetime
-from utils import connectToDb
+from datetime import date, datetime, timedelta
+from utils import dbSession, DataError, canonicalDateTime, epochOf, parseDateTime
+from migrations import migrate, backfill_appointment_dates
+from query_stats import instrument
+from records import (AppointmentRecord, APPOINTMENT_COLUMNS, ScheduleEntry, SCHEDULE_COLUMNS, FollowUp,
+                     FOLLOWUP_COLUMNS, records_frame)
 
+# أول أيام أسبوع العمل في العيادة (الأحد)، بترقيم date.weekday()
+WEEK_START = 6
+
+@instrument
 class Appointment:
     def __init__(self, db_file="patients.db"):
         self.db_file = db_file
         self.setup_database()
 
     def setup_database(self):
-        conn, cursor = connectToDb(self.db_file)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appointments (
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                PatientID INTEGER NOT NULL,
-                AppointmentDate TEXT NOT NULL,
-                Condition TEXT,
-                Treatment TEXT,
-                Symptoms TEXT,
-                Notes TEXT,
-                NextAppointment TEXT,
-                DateAdded TEXT DEFAULT CURRENT_TIMESTAMP,
-                LastModified TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (PatientID) REFERENCES patients(ID) ON DELETE CASCADE
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        migrate(self.db_file)
 
     def add_appointment(self, patient_id, data):
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("""
-                INSERT INTO appointments (
-                    PatientID, AppointmentDate, Condition, Treatment, Symptoms, Notes, NextAppointment
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                patient_id,
-                data.get("AppointmentDate", datetime.now().strftime("%Y-%m-%d")),
-                data.get("Condition", ""),
-                data.get("Treatment", ""),
-                data.get("Symptoms", ""),
-                data.get("Notes", ""),
-                data.get("NextAppointment", "")
-            ))
-            conn.commit()
-            new_id = cursor.lastrowid
-            conn.close()
-            return new_id
+            appointment_date = data.get("AppointmentDate", datetime.now().strftime("%Y-%m-%d"))
+            next_appointment = data.get("NextAppointment", "")
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("""
+                    INSERT INTO appointments (
+                        PatientID, AppointmentDate, Condition, Treatment, Symptoms, Notes, NextAppointment,
+                        AppointmentISO, AppointmentTs, NextAppointmentISO, NextAppointmentTs
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    int(patient_id),
+                    appointment_date,
+                    data.get("Condition", ""),
+                    data.get("Treatment", ""),
+                    data.get("Symptoms", ""),
+                    data.get("Notes", ""),
+                    next_appointment,
+                    *canonicalDateTime(appointment_date),
+                    *canonicalDateTime(next_appointment)
+                ))
+                return cursor.lastrowid
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في إضافة الموعد: {e}")
-            return None
+            raise DataError(f"فشل في إضافة الموعد: {e}", "add_appointment") from e
+
+    def _fetch_records(self, query, params=(), as_frame=False):
+        # سجلات AppointmentRecord افتراضياً؛ الإطار لمن يطلبه للتحليل أو التصدير
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute(query, params)
+            records = [AppointmentRecord(*row) for row in cursor.fetchall()]
+        return records_frame(records, AppointmentRecord) if as_frame else records
 
-    def get_appointments_by_patient(self, patient_id):
+    def get_appointments_by_patient(self, patient_id, as_frame=False):
         try:
-            conn, _ = connectToDb(self.db_file)
-            df = pd.read_sql_query(
-                "SELECT * FROM appointments WHERE PatientID = ? ORDER BY AppointmentDate DESC",
-                conn, params=(patient_id,)
-            )
-            conn.close()
-            return df
+            return self._fetch_records(
+                f"SELECT {APPOINTMENT_COLUMNS} FROM appointments WHERE PatientID = ? ORDER BY AppointmentTs DESC",
+                (patient_id,), as_frame)
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء جلب المواعيد: {e}")
-            return pd.DataFrame()
+            raise DataError(f"حدث خطأ أثناء جلب المواعيد: {e}", "get_appointments_by_patient") from e
 
     def update_appointment(self, appointment_id, new_data):
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("""
-                UPDATE appointments
-                SET AppointmentDate=?, Condition=?, Treatment=?, Symptoms=?, Notes=?, NextAppointment=?, LastModified=CURRENT_TIMESTAMP
-                WHERE ID=?
-            """, (
-                new_data.get("AppointmentDate", ""),
-                new_data.get("Condition", ""),
-                new_data.get("Treatment", ""),
-                new_data.get("Symptoms", ""),
-                new_data.get("Notes", ""),
-                new_data.get("NextAppointment", ""),
-                appointment_id
-            ))
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
-            return success
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("""
+                    UPDATE appointments
+                    SET AppointmentDate=?, Condition=?, Treatment=?, Symptoms=?, Notes=?, NextAppointment=?,
+                        AppointmentISO=?, AppointmentTs=?, NextAppointmentISO=?, NextAppointmentTs=?,
+                        LastModified=CURRENT_TIMESTAMP
+                    WHERE ID=?
+                """, (
+                    new_data.get("AppointmentDate", ""),
+                    new_data.get("Condition", ""),
+                    new_data.get("Treatment", ""),
+                    new_data.get("Symptoms", ""),
+                    new_data.get("Notes", ""),
+                    new_data.get("NextAppointment", ""),
+                    *canonicalDateTime(new_data.get("AppointmentDate", "")),
+                    *canonicalDateTime(new_data.get("NextAppointment", "")),
+                    appointment_id
+                ))
+                return cursor.rowcount > 0
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في تحديث الموعد: {e}")
-            return False
+            raise DataError(f"فشل في تحديث الموعد: {e}", "update_appointment") from e
 
     def delete_appointment(self, appointment_id):
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("DELETE FROM appointments WHERE ID=?", (appointment_id,))
-            conn.commit()
-            conn.close()
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("DELETE FROM appointments WHERE ID=?", (appointment_id,))
+        except Exception as e:
+            raise DataError(f"فشل في حذف الموعد: {e}", "delete_appointment") from e
+
+    def delete_appointments(self, appointment_ids):
+        # حذف عدة مواعيد في معاملة واحدة؛ يعيد عدد المواعيد المحذوفة
+        try:
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.executemany("DELETE FROM appointments WHERE ID=?",
+                                   [(int(i),) for i in appointment_ids])
+                return cursor.rowcount
+        except Exception as e:
+            raise DataError(f"فشل في حذف المواعيد: {e}", "delete_appointments") from e
+
+    def get_all_appointments(self, limit=100, as_frame=False):
+        try:
+            return self._fetch_records(
+                f"SELECT {APPOINTMENT_COLUMNS} FROM appointments ORDER BY AppointmentTs DESC LIMIT ?",
+                (limit,), as_frame)
+        except Exception as e:
+            raise DataError(f"فشل في تحميل المواعيد: {e}", "get_all_appointments") from e
+
+    def get_appointments_between(self, start, end, limit=None, as_frame=False):
+        """Appointments from start (inclusive) to end (exclusive) in time order, read by an index range scan.
+
+        start and end may be dates, datetimes or any text format parseDateTime reads.
+        """
+        start_ts, end_ts = epochOf(start), epochOf(end)
+        if start_ts is None or end_ts is None:
+            raise DataError(f"مجال تاريخ غير صالح: {start!r} - {end!r}", "get_appointments_between")
+        query = (f"SELECT {APPOINTMENT_COLUMNS} FROM appointments"
+                 " WHERE AppointmentTs >= ? AND AppointmentTs < ? ORDER BY AppointmentTs")
+        params = [start_ts, end_ts]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        try:
+            return self._fetch_records(query, params, as_frame)
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في حذف الموعد: {e}")
+            raise DataError(f"فشل في تحميل المواعيد: {e}", "get_appointments_between") from e
+
+    # ------------------ جدول المواعيد ------------------
+
+    def get_schedule(self, start, end, limit=None, as_frame=False):
+        """ScheduleEntry rows from start (inclusive) to end (exclusive) in time order.
 
-    def get_all_appointments(self, limit=100):
+        One query: a range scan on idx_appointments_ts joined to patients by primary key, so the
+        cost follows the number of appointments in the range, not the size of the history.
+        Appointments of deleted patients are left out.
+        """
+        start_ts, end_ts = epochOf(start), epochOf(end)
+        if start_ts is None or end_ts is None:
+            raise DataError(f"مجال تاريخ غير صالح: {start!r} - {end!r}", "get_schedule")
+        query = f"""
+            SELECT {SCHEDULE_COLUMNS} FROM appointments a JOIN patients p ON p.ID = a.PatientID
+            WHERE a.AppointmentTs >= ? AND a.AppointmentTs < ? AND p.Deleted = 0
+            ORDER BY a.AppointmentTs, a.ID
+        """
+        params = [start_ts, end_ts]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
         try:
-            conn, _ = connectToDb(self.db_file)
-            df = pd.read_sql_query(
-                "SELECT * FROM appointments ORDER BY AppointmentDate DESC LIMIT ?",
-                conn, params=(limit,)
-            )
-            conn.close()
-            return df
+            with dbSession(self.db_file, readonly=True) as (conn, cursor):
+                cursor.execute(query, params)
+                entries = [ScheduleEntry(*row) for row in cursor.fetchall()]
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في تحميل المواعيد: {e}")
-            return pd.DataFrame()
+            raise DataError(f"فشل في تحميل جدول المواعيد: {e}", "get_schedule") from e
+        return records_frame(entries, ScheduleEntry) if as_frame else entries
+
+    @staticmethod
+    def week_bounds(day=None):
+        """(first day, day after the last) of the clinic week containing day."""
+        day = _as_date(day)
+        first = day - timedelta(days=(day.weekday() - WEEK_START) % 7)
+        return first, first + timedelta(days=7)
+
+    def get_day_schedule(self, day=None, as_frame=False):
+        day = _as_date(day)
+        return self.get_schedule(day, day + timedelta(days=1), as_frame=as_frame)
+
+    def get_week_schedule(self, day=None, as_frame=False):
+        return self.get_schedule(*self.week_bounds(day), as_frame=as_frame)
+
+    def schedule_summary(self, start_day, end_day):
+        """{day: count} for every day from start_day to end_day inclusive, zeros included.
+
+        Read from daily_appointment_counts, which the triggers keep up to date on every write.
+        """
+        start_day, end_day = _as_date(start_day), _as_date(end_day)
+        counts = self.daily_counts(start_day.isoformat(), end_day.isoformat())
+        days = [(start_day + timedelta(days=i)).isoformat() for i in range((end_day - start_day).days + 1)]
+        return {day: counts.get(day, 0) for day in days}
+
+    def week_summary(self, day=None):
+        first, after_last = self.week_bounds(day)
+        return self.schedule_summary(first, after_last - timedelta(days=1))
+
+    # ------------------ المتابعات ------------------
+    # من جدول followups الذي تحدّثه المشغّلات: سطر لكل مريض، مفهرس بموعد المتابعة
+
+    def _fetch_followups(self, condition, params, limit, operation):
+        query = f"""
+            SELECT {FOLLOWUP_COLUMNS} FROM followups f JOIN patients p ON p.ID = f.PatientID
+            WHERE {condition} AND p.Deleted = 0 ORDER BY f.DueTs, f.PatientID
+        """
+        if limit is not None:
+            query += " LIMIT ?"
+            params = [*params, int(limit)]
+        try:
+            with dbSession(self.db_file, readonly=True) as (conn, cursor):
+                cursor.execute(query, params)
+                return [FollowUp(*row) for row in cursor.fetchall()]
+        except Exception as e:
+            raise DataError(f"فشل في تحميل المتابعات: {e}", operation) from e
+
+    def get_due_followups(self, start=None, end=None, limit=None):
+        """Follow-ups due on the days from start (inclusive, default today) to end (exclusive, default the next day)."""
+        # DueTs تاريخ يوم، فالحدود تُقرّب إلى بداية يومها: ساعة start لا تُخفي متابعات اليوم نفسه
+        first = _as_date(start, "get_due_followups")
+        after_last = first + timedelta(days=1) if end is None else _as_date(end, "get_due_followups")
+        return self._fetch_followups("f.DueTs >= ? AND f.DueTs < ?", [epochOf(first), epochOf(after_last)],
+                                     limit, "get_due_followups")
+
+    def get_overdue_followups(self, today=None, since=None, limit=None):
+        """Follow-ups due before today with no visit after them, oldest first; since bounds how far back."""
+        params = [epochOf(_as_date(today))]
+        condition = "f.DueTs < ?"
+        if since is not None:
+            condition += " AND f.DueTs >= ?"
+            params.append(epochOf(_as_date(since)))
+        return self._fetch_followups(condition, params, limit, "get_overdue_followups")
+
+    def followup_counts(self, today=None):
+        """{"due_today", "overdue"}: two counts on idx_followups_due, cheap enough for a periodic check."""
+        start = _as_date(today)
+        start_ts, end_ts = epochOf(start), epochOf(start + timedelta(days=1))
+        try:
+            with dbSession(self.db_file, readonly=True) as (conn, cursor):
+                cursor.execute("""
+                    SELECT
+                        (SELECT COUNT(*) FROM followups f JOIN patients p ON p.ID = f.PatientID
+                         WHERE f.DueTs >= ? AND f.DueTs < ? AND p.Deleted = 0),
+                        (SELECT COUNT(*) FROM followups f JOIN patients p ON p.ID = f.PatientID
+                         WHERE f.DueTs < ? AND p.Deleted = 0)
+                """, (start_ts, end_ts, start_ts))
+                due_today, overdue = cursor.fetchone()
+        except Exception as e:
+            raise DataError(f"فشل في حساب المتابعات: {e}", "followup_counts") from e
+        return {"due_today": due_today, "overdue": overdue}
+
+    def dismiss_followup(self, patient_id):
+        # إزالة يدوية (تم الاتصال بالمريض مثلاً)؛ أي موعد جديد له يعيد حساب متابعته
+        try:
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("DELETE FROM followups WHERE PatientID = ?", (int(patient_id),))
+                return cursor.rowcount > 0
+        except Exception as e:
+            raise DataError(f"فشل في إزالة المتابعة: {e}", "dismiss_followup") from e
+
+    def backfill_dates(self):
+        # للمواعيد التي كتبتها أدوات أخرى دون الأعمدة القياسية؛ يعيد عدد الصفوف التي مُلئت
+        try:
+            with dbSession(self.db_file) as (conn, cursor):
+                return backfill_appointment_dates(cursor)
+        except Exception as e:
+            raise DataError(f"فشل في تحويل تواريخ المواعيد: {e}", "backfill_dates") from e
+
+    # ------------------ العدادات ------------------
+
+    def _read_counter(self, query, params=()):
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            return row[0] if row else 0
+
     def count(self):
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("SELECT COUNT(*) FROM appointments WHERE Deleted = 0")
-            total = cursor.fetchone()[0]
-            conn.close()
-            return total
-        except:
+            return self._read_counter("SELECT Value FROM stats WHERE Name = 'appointments'")
+        except Exception:
             return 0
+
+    def count_for_patient(self, patient_id):
+        return self._read_counter(
+            "SELECT Total FROM patient_appointment_counts WHERE PatientID = ?", (patient_id,))
+
+    def count_for_day(self, day=None):
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        return self._read_counter("SELECT Total FROM daily_appointment_counts WHERE Day = ?", (str(day),))
+
+    def daily_counts(self, start_day, end_day):
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute(
+                "SELECT Day, Total FROM daily_appointment_counts WHERE Day BETWEEN ? AND ? AND Total > 0 ORDER BY Day",
+                (str(start_day), str(end_day)))
+            return dict(cursor.fetchall())
+
+
+def _as_date(value, operation="schedule"):
+    if value is None:
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    parsed, _ = parseDateTime(value)
+    if parsed is None:
+        raise DataError(f"تاريخ غير صالح: {value!r}", operation)
+    return parsed.date()
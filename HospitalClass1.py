@@ -1,240 +1,551 @@
-import pandas as pd
+import base64
 import json
-from tkinter import messagebox
-from utils import connectToDb
+import os
+import re
+import threading
+from collections import OrderedDict
+from utils import dbSession, normalizeContact, DataError, changeToken, canonicalDateTime
+from records import (PatientRecord, PhotoRecord, AppointmentRecord, PATIENT_COLUMNS, PHOTO_COLUMNS,
+                     APPOINTMENT_COLUMNS, columns_of, records_frame)
+from photo_store import PhotoStore
+from migrations import migrate, fill_search_index, has_table, rebuild_stats
+from query_cache import QueryCache, RESULT_CACHE_BYTES
+from query_stats import instrument
 
+# مقطع trigram يحتاج ثلاثة أحرف على الأقل
+MIN_FTS_TERM = 3
+# عبارة بحث تبدو رقم هاتف: أرقام (لاتينية أو عربية) ورموز الكتابة المعتادة
+PHONE_TERM = re.compile(r"[\d+\s().\-]+")
+# عدد سجلات المرضى المحفوظة في ذاكرة get_patient
+PATIENT_CACHE_SIZE = 128
+# أقصى عدد تغييرات يُعاد في دفعة واحدة؛ ما زاد عنه يعني أن إعادة التحميل الكامل أرخص
+CHANGES_LIMIT = 5000
+UPDATABLE_FIELDS = ("FirstName", "LastName", "Age", "Gender", "Contact", "Photos")
+# أعمدة السجل مسبوقة باسم الجدول، لاستعلامات الربط مع فهرس البحث
+JOINED_PATIENT_COLUMNS = columns_of(PatientRecord, "p")
 
+
+@instrument
 class Hospital:
-    def __init__(self, db_file="patients.db"):
+    def __init__(self, db_file="patients.db", cache_bytes=RESULT_CACHE_BYTES):
         self.db_file = db_file
+        self.fts_enabled = False
+        self._patient_cache = OrderedDict()
+        self._patient_cache_lock = threading.Lock()
+        self._patient_cache_token = None
+        # نتائج القراءات الكاملة، صالحة حتى أي كتابة على الملف من هذه المحطة أو غيرها
+        self.result_cache = QueryCache(cache_bytes)
+        self.photo_store = PhotoStore(db_file)
         self.setup_database()
 
     def setup_database(self):
-        conn, cursor = connectToDb(self.db_file)
-
-        # جدول المرضى
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                FirstName TEXT NOT NULL,
-                LastName TEXT NOT NULL,
-                Age INTEGER NOT NULL,
-                Gender TEXT NOT NULL,
-                Contact TEXT,
-                Photos TEXT,
-                DateAdded TEXT DEFAULT CURRENT_TIMESTAMP,
-                LastModified TEXT DEFAULT CURRENT_TIMESTAMP,
-                Deleted INTEGER DEFAULT 0
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        migrate(self.db_file)
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            self.fts_enabled = has_table(cursor, "patients_fts")
+
+    def rebuild_search_index(self):
+        if not self.fts_enabled:
+            return False
+        with dbSession(self.db_file) as (conn, cursor):
+            fill_search_index(cursor)
+            cursor.execute("INSERT INTO patients_fts (patients_fts) VALUES ('optimize')")
+        return True
 
     # ------------------ المرضى ------------------
 
-    def get_all_patients(self):
+    def get_all_patients(self, copy=True):
+        """Every live patient as a DataFrame; a private copy of the cached frame by default.
+
+        copy=False returns the cached frame itself, for internal readers that never modify it.
+        """
+        # إطار كامل للتحليل والتصدير؛ الواجهة تستعمل الصفحات والسجلات
         try:
-            conn = connectToDb(self.db_file)[0]
-            df = pd.read_sql_query("SELECT * FROM patients WHERE Deleted = 0 ORDER BY ID DESC", conn)
-            conn.close()
-            return df
+            frame = self.result_cache.get("all_patients", changeToken(self.db_file), self._read_all_patients)
+            return frame.copy() if copy else frame
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء تحميل المرضى: {e}")
-            return pd.DataFrame()
+            raise DataError(f"حدث خطأ أثناء تحميل المرضى: {e}", "get_all_patients") from e
+
+    def _read_all_patients(self):
+        # pandas ثقيل الاستيراد، فلا يُحمّل إلا عند أول طلب للإطار الكامل
+        import pandas as pd
+        with dbSession(self.db_file, readonly=True) as (conn, _):
+            return pd.read_sql_query(f"SELECT {PATIENT_COLUMNS} FROM patients WHERE Deleted = 0 ORDER BY ID DESC",
+                                     conn)
+
+    def cache_stats(self):
+        return self.result_cache.stats()
 
     def get_total_patients(self):
-        conn, cursor = connectToDb(self.db_file)
-        cursor.execute("SELECT COUNT(*) FROM patients WHERE Deleted = 0")
-        total = cursor.fetchone()[0]
-        conn.close()
-        return total
-
-    def search_patients(self, search_term, page=1, per_page=50):
-        query = "SELECT * FROM patients WHERE Deleted = 0"
-        params = []
+        return self.get_stats()["live_patients"]
 
-        if search_term:
-            query += " AND (LOWER(FirstName) LIKE ? OR LOWER(LastName) LIKE ? OR LOWER(Contact) LIKE ?)"
-            params.extend([f'%{search_term.lower()}%'] * 3)
+    def get_stats(self):
+        # عدادات تحدّثها المشغّلات: live_patients, deleted_patients, appointments
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute("SELECT Name, Value FROM stats")
+            stats = {"live_patients": 0, "deleted_patients": 0, "appointments": 0}
+            stats.update(cursor.fetchall())
+            return stats
 
-        query += " ORDER BY ID DESC LIMIT ? OFFSET ?"
+    def rebuild_stats(self):
+        with dbSession(self.db_file) as (conn, cursor):
+            rebuild_stats(cursor)
+
+    def search_patients(self, search_term, page=1, per_page=50, as_frame=False):
+        query = f"SELECT {PATIENT_COLUMNS} FROM patients WHERE Deleted = 0"
+        params = []
+        search_term = (search_term or "").strip()
         offset = (page - 1) * per_page
-        params.extend([per_page, offset])
+
+        if self.fts_enabled and len(search_term) >= MIN_FTS_TERM:
+            # النتائج مرتبة حسب الصلة (bm25) ثم الأحدث
+            query = f"""
+                SELECT {JOINED_PATIENT_COLUMNS} FROM patients_fts f JOIN patients p ON p.ID = f.rowid
+                WHERE patients_fts MATCH ? AND p.Deleted = 0
+                ORDER BY f.rank, p.ID DESC LIMIT ? OFFSET ?
+            """
+            params = [self._fts_query(search_term), per_page, offset]
+        else:
+            if search_term:
+                query += " AND (LOWER(FirstName) LIKE ? OR LOWER(LastName) LIKE ? OR LOWER(Contact) LIKE ?)"
+                params.extend([f'%{search_term.lower()}%'] * 3)
+
+            query += " ORDER BY ID DESC LIMIT ? OFFSET ?"
+            params.extend([per_page, offset])
 
         try:
-            conn = connectToDb(self.db_file)[0]
-            df = pd.read_sql_query(query, conn, params=params)
-            conn.close()
-            return df
+            records = self._fetch_records(query, params)
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء البحث: {e}")
-            return pd.DataFrame()
+            raise DataError(f"حدث خطأ أثناء البحث: {e}", "search_patients") from e
+        return records_frame(records, PatientRecord) if as_frame else records
+
+    # ------------------ التصفح بالمؤشر (keyset) ------------------
+    # كل صفحة تبدأ من آخر ID في الصفحة السابقة، فالتكلفة ثابتة مهما كان عمق الصفحة
+
+    @staticmethod
+    def encode_page_token(last_id):
+        raw = json.dumps({"after": int(last_id)}).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    @staticmethod
+    def decode_page_token(token):
+        if not token:
+            return None
+        try:
+            return int(json.loads(base64.urlsafe_b64decode(token.encode()))["after"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"رمز صفحة غير صالح: {token!r}") from e
+
+    def _fetch_page(self, query, params, per_page, cancel=None, as_frame=False):
+        # نجلب صفاً إضافياً لنعرف إن كانت هناك صفحة تالية
+        with dbSession(self.db_file, readonly=True, cancel=cancel) as (conn, cursor):
+            cursor.execute(query, params + [per_page + 1])
+            rows = cursor.fetchmany(per_page + 1)
+        records = [PatientRecord(*row) for row in rows[:per_page]]
+        token = self.encode_page_token(records[-1].ID) if len(rows) > per_page else None
+        return (records_frame(records, PatientRecord) if as_frame else records), token
+
+    def list_patients_page(self, page_token=None, per_page=50, cancel=None, as_frame=False):
+        """One keyset page: (records, next_token); as_frame=True returns a DataFrame instead."""
+        after_id = self.decode_page_token(page_token)
+        query = f"SELECT {PATIENT_COLUMNS} FROM patients WHERE Deleted = 0"
+        params = []
+        if after_id is not None:
+            query += " AND ID < ?"
+            params.append(after_id)
+        query += " ORDER BY ID DESC LIMIT ?"
+        try:
+            return self._fetch_page(query, params, per_page, cancel, as_frame)
+        except Exception as e:
+            raise DataError(f"حدث خطأ أثناء تحميل المرضى: {e}", "list_patients_page") from e
+
+    def search_patients_page(self, search_term, page_token=None, per_page=50, cancel=None, as_frame=False):
+        search_term = (search_term or "").strip()
+        if not search_term:
+            return self.list_patients_page(page_token, per_page, cancel, as_frame)
+        after_id = self.decode_page_token(page_token)
+
+        if self.fts_enabled and len(search_term) >= MIN_FTS_TERM:
+            # الترتيب هنا حسب ID وليس الصلة، ليبقى المؤشر صالحاً
+            query = f"""
+                SELECT {JOINED_PATIENT_COLUMNS} FROM patients_fts f JOIN patients p ON p.ID = f.rowid
+                WHERE patients_fts MATCH ? AND p.Deleted = 0
+            """
+            params = [self._fts_query(search_term)]
+            if after_id is not None:
+                query += " AND f.rowid < ?"
+                params.append(after_id)
+            query += " ORDER BY f.rowid DESC LIMIT ?"
+        else:
+            query = f"""
+                SELECT {PATIENT_COLUMNS} FROM patients WHERE Deleted = 0
+                AND (LOWER(FirstName) LIKE ? OR LOWER(LastName) LIKE ? OR LOWER(Contact) LIKE ?)
+            """
+            params = [f'%{search_term.lower()}%'] * 3
+            if after_id is not None:
+                query += " AND ID < ?"
+                params.append(after_id)
+            query += " ORDER BY ID DESC LIMIT ?"
+
+        try:
+            return self._fetch_page(query, params, per_page, cancel, as_frame)
+        except Exception as e:
+            raise DataError(f"حدث خطأ أثناء البحث: {e}", "search_patients_page") from e
+
+    @staticmethod
+    def _fts_phrase(search_term):
+        return '"' + search_term.replace('"', '""') + '"'
+
+    @classmethod
+    def _fts_query(cls, search_term):
+        # الفهرس يحمل رقم التواصل بشكله القياسي، فيُطابَق الرقم المكتوب بأي صيغة (+213… أو 0…)
+        query = cls._fts_phrase(search_term)
+        if PHONE_TERM.fullmatch(search_term):
+            contact = normalizeContact(search_term)
+            if contact and len(contact) >= MIN_FTS_TERM and contact != search_term:
+                query += " OR ContactNorm : " + cls._fts_phrase(contact)
+        return query
 
     def add_patient(self, data):
         try:
             age = int(data["Age"])
             photos_json = json.dumps(data.get("Photos", []))
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("""
-                INSERT INTO patients (FirstName, LastName, Age, Gender, Contact, Photos)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (data["FirstName"], data["LastName"], age, data["Gender"],
-                  data.get("Contact", None), photos_json))
-            conn.commit()
-            new_id = cursor.lastrowid
-            conn.close()
-            return new_id
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("""
+                    INSERT INTO patients (FirstName, LastName, Age, Gender, Contact, ContactNorm, Photos)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (data["FirstName"], data["LastName"], age, data["Gender"],
+                      data.get("Contact", None), normalizeContact(data.get("Contact")), photos_json))
+                return cursor.lastrowid
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في إضافة المريض: {e}")
-            return None
+            raise DataError(f"فشل في إضافة المريض: {e}", "add_patient") from e
 
     def update_patient(self, patient_id, new_data):
         try:
             age = int(new_data["Age"])
-            photos_json = json.dumps(new_data.get("Photos", []))
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("""
-                UPDATE patients
-                SET FirstName=?, LastName=?, Age=?, Gender=?, Contact=?, Photos=?, LastModified=CURRENT_TIMESTAMP
-                WHERE ID=?
-            """, (new_data["FirstName"], new_data["LastName"], age, new_data["Gender"],
-                  new_data.get("Contact", None), photos_json, patient_id))
-            conn.commit()
-            rows_affected = cursor.rowcount
-            conn.close()
-            return rows_affected > 0
+            # قائمة Photos القديمة لا تُمس إلا إذا مُرّرت صراحةً؛ الصور الجديدة في جدول photos
+            photos_json = json.dumps(new_data["Photos"]) if "Photos" in new_data else None
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("""
+                    UPDATE patients
+                    SET FirstName=?, LastName=?, Age=?, Gender=?, Contact=?, ContactNorm=?, Photos=COALESCE(?, Photos), LastModified=CURRENT_TIMESTAMP
+                    WHERE ID=?
+                """, (new_data["FirstName"], new_data["LastName"], age, new_data["Gender"],
+                      new_data.get("Contact", None), normalizeContact(new_data.get("Contact")),
+                      photos_json, patient_id))
+                updated = cursor.rowcount > 0
+            self.invalidate_patients([patient_id])
+            return updated
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء التحديث: {e}")
-            return False
+            raise DataError(f"حدث خطأ أثناء التحديث: {e}", "update_patient") from e
 
     def delete_patient(self, patient_id):
+        self.delete_patients([patient_id])
+
+    # ------------------ عمليات جماعية في معاملة واحدة ------------------
+
+    def delete_patients(self, patient_ids):
+        # حذف منطقي لعدة مرضى؛ يعيد عدد الصفوف التي تغيّرت فعلاً
+        ids = [(int(i),) for i in patient_ids]
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("UPDATE patients SET Deleted = 1 WHERE ID=?", (patient_id,))
-            conn.commit()
-            conn.close()
+            with dbSession(self.db_file) as (conn, cursor):
+                # LastModified يجعل الحذف يظهر في get_patient_changes
+                cursor.executemany(
+                    "UPDATE patients SET Deleted = 1, LastModified = CURRENT_TIMESTAMP WHERE ID = ? AND Deleted = 0", ids)
+                deleted = cursor.rowcount
+            self.invalidate_patients([i for (i,) in ids])
+            return deleted
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء الحذف: {e}")
+            raise DataError(f"حدث خطأ أثناء الحذف: {e}", "delete_patients") from e
 
-    def export_data(self, file_path):
-        df = self.get_all_patients()
-        df.to_excel(file_path, index=False)
+    def update_patients(self, changes):
+        # changes: {ID: {الحقل: القيمة}}؛ تُجمع الصفوف ذات الحقول نفسها في executemany واحد
+        groups = {}
+        for patient_id, fields in changes.items():
+            values = {}
+            for field, value in fields.items():
+                if field not in UPDATABLE_FIELDS:
+                    raise ValueError(f"حقل غير قابل للتحديث: {field}")
+                if field == "Age":
+                    value = int(value)
+                elif field == "Photos":
+                    value = json.dumps(value or [])
+                values[field] = value
+            if "Contact" in values:
+                values["ContactNorm"] = normalizeContact(values["Contact"])
+            if values:
+                groups.setdefault(tuple(sorted(values)), []).append(
+                    [values[f] for f in sorted(values)] + [int(patient_id)])
 
-    def import_data(self, file_path):
+        updated = 0
         try:
-            df = pd.read_excel(file_path)
-            conn, cursor = connectToDb(self.db_file)
-            expected_columns = ["FirstName", "LastName", "Age", "Gender"]
-
-            if not all(col in df.columns for col in expected_columns):
-                messagebox.showerror("خطأ", "يجب أن يحتوي ملف الإكسل على الأعمدة المطلوبة")
-                return False
-
-            for _, row in df.iterrows():
-                try:
-                    age = int(row["Age"])
-                except (ValueError, TypeError):
-                    continue
-                cursor.execute("""
-                    INSERT INTO patients (FirstName, LastName, Age, Gender, Contact, Photos)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (row["FirstName"], row["LastName"], age, row["Gender"],
-                      row.get("Contact", None), json.dumps([])))
-            conn.commit()
-            conn.close()
-            return True
+            with dbSession(self.db_file) as (conn, cursor):
+                for field_names, rows in groups.items():
+                    assignments = ", ".join(f"{f}=?" for f in field_names)
+                    cursor.executemany(
+                        f"UPDATE patients SET {assignments}, LastModified=CURRENT_TIMESTAMP WHERE ID=?", rows)
+                    updated += cursor.rowcount
+            self.invalidate_patients(changes.keys())
+            return updated
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء الاستيراد: {e}")
-            return False
+            raise DataError(f"حدث خطأ أثناء التحديث: {e}", "update_patients") from e
+
+    def export_data(self, file_path, columns=None, date_from=None, date_to=None, progress=None):
+        # الصيغة حسب الامتداد: xlsx أو csv أو parquet؛ يعيد عدد الصفوف المصدّرة
+        from data_io import export_patients
+        return export_patients(self.db_file, file_path, columns=columns,
+                               date_from=date_from, date_to=date_to, progress=progress)
+
+    def import_data(self, file_path, progress=None, reject_path=None):
+        # يعيد ملخصاً {"imported", "rejected", "reject_file"}؛ يرفع DataError عند الفشل
+        from data_io import import_patients, ImportFormatError
+        try:
+            return import_patients(self.db_file, file_path, progress=progress, reject_path=reject_path)
+        except ImportFormatError as e:
+            raise DataError(f"يجب أن يحتوي ملف الإكسل على الأعمدة المطلوبة\n{e}", "import_data") from e
+        except Exception as e:
+            raise DataError(f"حدث خطأ أثناء الاستيراد: {e}", "import_data") from e
+
+    # ------------------ الصور ------------------
+
+    def attach_photos(self, patient_id, file_paths):
+        # النسخ إلى المخزن يتم خارج المعاملة، ثم تُسجّل كل الصور في معاملة واحدة
+        stored = [self.photo_store.put_file(path) for path in file_paths]
+        return self.save_photo_records(patient_id, stored)
+
+    def attach_photo(self, patient_id, file_path):
+        photos = self.attach_photos(patient_id, [file_path])
+        return photos[0] if photos else None
+
+    def save_photo_records(self, patient_id, stored):
+        with dbSession(self.db_file) as (conn, cursor):
+            cursor.executemany("""
+                INSERT OR IGNORE INTO photos (PatientID, Hash, Extension, OriginalName, Size, Width, Height)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(int(patient_id), p["Hash"], p["Extension"], p["OriginalName"],
+                   p["Size"], p["Width"], p["Height"]) for p in stored])
+        hashes = {p["Hash"] for p in stored}
+        return [photo for photo in self.list_photos(patient_id) if photo.Hash in hashes]
+
+    def list_photos(self, patient_id):
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute(f"SELECT {PHOTO_COLUMNS} FROM photos WHERE PatientID = ? ORDER BY ID", (int(patient_id),))
+            return [PhotoRecord(*row) for row in cursor.fetchall()]
+
+    def photo_path(self, photo):
+        return self.photo_store.path_for(photo.Hash, photo.Extension)
+
+    def open_photo(self, photo):
+        # ملف ثنائي للقراءة على دفعات دون تحميل الصورة كاملة
+        return self.photo_store.open(photo.Hash, photo.Extension)
+
+    def detach_photos(self, photo_ids):
+        ids = [int(i) for i in photo_ids]
+        if not ids:
+            return 0
+        placeholders = ", ".join("?" * len(ids))
+        with dbSession(self.db_file) as (conn, cursor):
+            cursor.execute(f"SELECT DISTINCT Hash, Extension FROM photos WHERE ID IN ({placeholders})", ids)
+            candidates = cursor.fetchall()
+            cursor.execute(f"DELETE FROM photos WHERE ID IN ({placeholders})", ids)
+            removed = cursor.rowcount
+            # الملف يُحذف فقط إذا لم يعد أي مريض يشير إليه
+            orphans = []
+            for file_hash, extension in candidates:
+                cursor.execute("SELECT 1 FROM photos WHERE Hash = ? LIMIT 1", (file_hash,))
+                if cursor.fetchone() is None:
+                    orphans.append((file_hash, extension))
+        for file_hash, extension in orphans:
+            self.photo_store.remove(file_hash, extension)
+        return removed
+
+    def import_legacy_photos(self):
+        # ينقل مسارات Photos (JSON) إلى المخزن؛ المسارات غير الموجودة تبقى في العمود كما هي
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute("SELECT ID, Photos FROM patients WHERE Photos IS NOT NULL AND Photos NOT IN ('', '[]')")
+            legacy = cursor.fetchall()
+        imported = 0
+        for patient_id, photos_json in legacy:
+            try:
+                paths = json.loads(photos_json)
+            except (TypeError, ValueError):
+                continue
+            existing = [path for path in paths if os.path.isfile(path)]
+            missing = [path for path in paths if not os.path.isfile(path)]
+            if existing:
+                imported += len(self.attach_photos(patient_id, existing))
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("UPDATE patients SET Photos = ? WHERE ID = ?", (json.dumps(missing), patient_id))
+        self.invalidate_patients()
+        return imported
 
     # ------------------ المواعيد ------------------
 
     def add_appointment(self, patient_id, data):
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute('''
-                INSERT INTO appointments 
-                (PatientID, AppointmentDate, Condition, Treatment, Symptoms, Notes, NextAppointment)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                patient_id,
-                data.get("AppointmentDate"),
-                data.get("Condition"),
-                data.get("Treatment"),
-                data.get("Symptoms"),
-                data.get("Notes"),
-                data.get("NextAppointment")
-            ))
-            conn.commit()
-            new_id = cursor.lastrowid
-            conn.close()
-            return new_id
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute('''
+                    INSERT INTO appointments
+                    (PatientID, AppointmentDate, Condition, Treatment, Symptoms, Notes, NextAppointment,
+                     AppointmentISO, AppointmentTs, NextAppointmentISO, NextAppointmentTs)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    int(patient_id),
+                    data.get("AppointmentDate"),
+                    data.get("Condition"),
+                    data.get("Treatment"),
+                    data.get("Symptoms"),
+                    data.get("Notes"),
+                    data.get("NextAppointment"),
+                    *canonicalDateTime(data.get("AppointmentDate")),
+                    *canonicalDateTime(data.get("NextAppointment"))
+                ))
+                return cursor.lastrowid
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في إضافة الموعد: {e}")
-            return None
+            raise DataError(f"فشل في إضافة الموعد: {e}", "add_appointment") from e
 
-    def get_appointments_by_patient(self, patient_id):
+    def get_appointments_by_patient(self, patient_id, as_frame=False):
         try:
-            conn = connectToDb(self.db_file)[0]
-            df = pd.read_sql_query(
-                "SELECT * FROM appointments WHERE PatientID = ? ORDER BY AppointmentDate DESC",
-                conn,
-                params=(patient_id,)
-            )
-            conn.close()
-            return df
+            records = self._fetch_records(
+                f"SELECT {APPOINTMENT_COLUMNS} FROM appointments WHERE PatientID = ? ORDER BY AppointmentTs DESC",
+                (patient_id,), AppointmentRecord)
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في جلب المواعيد: {e}")
-            return pd.DataFrame()
+            raise DataError(f"فشل في جلب المواعيد: {e}", "get_appointments_by_patient") from e
+        return records_frame(records, AppointmentRecord) if as_frame else records
 
     def update_appointment(self, appointment_id, new_data):
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute('''
-                UPDATE appointments
-                SET AppointmentDate=?, Condition=?, Treatment=?, Symptoms=?, Notes=?, NextAppointment=?, LastModified=CURRENT_TIMESTAMP
-                WHERE ID=?
-            ''', (
-                new_data.get("AppointmentDate"),
-                new_data.get("Condition"),
-                new_data.get("Treatment"),
-                new_data.get("Symptoms"),
-                new_data.get("Notes"),
-                new_data.get("NextAppointment"),
-                appointment_id
-            ))
-            conn.commit()
-            result = cursor.rowcount
-            conn.close()
-            return result > 0
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute('''
+                    UPDATE appointments
+                    SET AppointmentDate=?, Condition=?, Treatment=?, Symptoms=?, Notes=?, NextAppointment=?,
+                        AppointmentISO=?, AppointmentTs=?, NextAppointmentISO=?, NextAppointmentTs=?,
+                        LastModified=CURRENT_TIMESTAMP
+                    WHERE ID=?
+                ''', (
+                    new_data.get("AppointmentDate"),
+                    new_data.get("Condition"),
+                    new_data.get("Treatment"),
+                    new_data.get("Symptoms"),
+                    new_data.get("Notes"),
+                    new_data.get("NextAppointment"),
+                    *canonicalDateTime(new_data.get("AppointmentDate")),
+                    *canonicalDateTime(new_data.get("NextAppointment")),
+                    appointment_id
+                ))
+                return cursor.rowcount > 0
         except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في تحديث الموعد: {e}")
-            return False
+            raise DataError(f"فشل في تحديث الموعد: {e}", "update_appointment") from e
 
     def delete_appointment(self, appointment_id):
         try:
-            conn, cursor = connectToDb(self.db_file)
-            cursor.execute("DELETE FROM appointments WHERE ID = ?", (appointment_id,))
-            conn.commit()
-            conn.close()
+            with dbSession(self.db_file) as (conn, cursor):
+                cursor.execute("DELETE FROM appointments WHERE ID = ?", (appointment_id,))
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء حذف الموعد: {e}")
-    
-    def find_patient_by_contact_or_lastname(self, contact, last_name):
-        try:
-            patients = self.get_all_patients()
-            filtered = patients[
-                (patients['Contact'] == contact) | (patients['LastName'] == last_name)
-            ]
+            raise DataError(f"حدث خطأ أثناء حذف الموعد: {e}", "delete_appointment") from e
 
-            if filtered.empty:
-                return pd.DataFrame({})  # لم يتم العثور على مريض
+    # ------------------ البحث المباشر عبر الفهارس ------------------
 
-            return filtered.iloc[0]  # إرجاع أول مريض مطابق
-        except Exception as e:
-            print("Error:", e)
-            return pd.DataFrame({})
+    def _fetch_records(self, query, params, record_type=PatientRecord):
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute(query, params)
+            return [record_type(*row) for row in cursor.fetchall()]
+
+    # ------------------ جلب مريض واحد مع ذاكرة LRU ------------------
+
+    def get_patient(self, patient_id):
+        return self.get_patients([patient_id]).get(int(patient_id))
+
+    def get_patients(self, patient_ids):
+        # يعيد {ID: PatientRecord}؛ المعرّفات غير الموجودة أو المحذوفة لا تظهر في الناتج
+        found, missing = {}, []
+        token = changeToken(self.db_file)
+        with self._patient_cache_lock:
+            # كتابة من محطة أخرى أو من كائن Hospital آخر على نفس الملف تُسقط الذاكرة
+            if token != self._patient_cache_token:
+                self._patient_cache.clear()
+                self._patient_cache_token = token
+            for patient_id in dict.fromkeys(int(i) for i in patient_ids):
+                record = self._patient_cache.get(patient_id)
+                if record is None:
+                    missing.append(patient_id)
+                else:
+                    self._patient_cache.move_to_end(patient_id)
+                    found[patient_id] = record
+
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            placeholders = ", ".join("?" * len(batch))
+            records = self._fetch_records(
+                f"SELECT {PATIENT_COLUMNS} FROM patients WHERE ID IN ({placeholders}) AND Deleted = 0", batch)
+            for record in records:
+                found[record.ID] = record
+            self._remember_patients(records)
+        return found
+
+    def _remember_patients(self, records):
+        with self._patient_cache_lock:
+            for record in records:
+                self._patient_cache[record.ID] = record
+                self._patient_cache.move_to_end(record.ID)
+            while len(self._patient_cache) > PATIENT_CACHE_SIZE:
+                self._patient_cache.popitem(last=False)
 
+    def invalidate_patients(self, patient_ids=None):
+        with self._patient_cache_lock:
+            if patient_ids is None:
+                self._patient_cache.clear()
+            else:
+                for patient_id in patient_ids:
+                    self._patient_cache.pop(int(patient_id), None)
 
+    # ------------------ التغييرات منذ علامة زمنية ------------------
 
+    def get_changes_watermark(self):
+        # أحدث LastModified في القاعدة: نقطة البداية لـ get_patient_changes
+        with dbSession(self.db_file, readonly=True) as (conn, cursor):
+            cursor.execute("SELECT MAX(LastModified) FROM patients")
+            return cursor.fetchone()[0] or ""
 
+    def get_patient_changes(self, since, limit=CHANGES_LIMIT):
+        """Patients modified at or after the watermark since, deleted ones included.
+
+        Returns (records, watermark, complete); pass watermark back next time. LastModified has
+        one-second resolution, so the boundary second is read again and callers must be idempotent.
+        """
+        records = self._fetch_records(
+            f"SELECT {PATIENT_COLUMNS} FROM patients WHERE LastModified >= ? ORDER BY LastModified LIMIT ?",
+            (since or "", limit + 1))
+        complete = len(records) <= limit
+        records = records[:limit]
+        # قد يكون التعديل من محطة أخرى، فلا نثق بما في الذاكرة
+        self.invalidate_patients([record.ID for record in records])
+        watermark = max([since or ""] + [record.LastModified or "" for record in records])
+        return records, watermark, complete
+
+    def find_patient_by_contact(self, contact):
+        contact_norm = normalizeContact(contact)
+        if not contact_norm:
+            return None
+        records = self._fetch_records(
+            f"SELECT {PATIENT_COLUMNS} FROM patients WHERE ContactNorm = ? AND Deleted = 0 ORDER BY ID DESC LIMIT 1",
+            (contact_norm,))
+        return records[0] if records else None
+
+    def find_patients_by_last_name(self, last_name, limit=20):
+        last_name = (last_name or "").strip()
+        if not last_name:
+            return []
+        return self._fetch_records(
+            f"SELECT {PATIENT_COLUMNS} FROM patients WHERE LastName = ? AND Deleted = 0 ORDER BY ID DESC LIMIT ?",
+            (last_name, limit))
+
+    def find_patient_by_contact_or_lastname(self, contact, last_name):
+        # رقم التواصل أدق من اللقب، لذلك يُجرّب أولاً؛ يعيد None إذا لم يوجد مريض
+        try:
+            patient = self.find_patient_by_contact(contact)
+            if patient is None:
+                matches = self.find_patients_by_last_name(last_name, limit=1)
+                patient = matches[0] if matches else None
+            return patient
+        except Exception as e:
+            raise DataError(f"حدث خطأ أثناء البحث عن المريض: {e}", "find_patient_by_contact_or_lastname") from e
@@ -1,27 +1,61 @@
 from tkinter import ttk, messagebox, filedialog
 import tkinter as tk
 from HospitalClass1 import Hospital
+from records import PhotoRecord
 
 from tkcalendar import DateEntry
 from datetime import datetime
-from PIL import Image, ImageTk
+from virtual_tree import VirtualTree
+from search_controller import SearchController
+from async_db import AsyncFacade
+from query_stats import STATS, format_report
 import os
 import json
+from operator import attrgetter
+
+# عدد المرضى في كل دفعة تُجلب عند التمرير
+PAGE_SIZE = 100
+# أعمدة نموذج الصفوف في الذاكرة (tuple لكل مريض)
+ROW_COLUMNS = ["ID", "FirstName", "LastName", "Age", "Gender", "Contact", "DateAdded", "LastModified"]
+ROW_GETTER = attrgetter(*ROW_COLUMNS)
+# عمود الشجرة -> موضعه في صف النموذج، للفرز
+SORT_COLUMNS = {"DisplayID": None, "InternalID": 0, "FirstName": 1, "LastName": 2, "Age": 3,
+                "Gender": 4, "Contact": 5, "DateAdded": 6, "LastModified": 7}
+
+
 class HospitalGUI(tk.Frame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.hospitals = {}
+        # لكل تبويب: (اسم القاعدة، Hospital، الشجرة، VirtualTree)؛ self.tree و self.patients_view للتبويب الظاهر
+        self.tabs = {}
+        self.tree = None
+        self.patients_view = None
         self.current_hospital = None
+        # كل وصول إلى القاعدة يمر عبر current_db في خيط خلفي؛ النتائج تعود إلى خيط Tk
+        self.current_db = None
+        self.tasks = AsyncFacade(None, self, on_error=self.show_data_error)
+        self.page_search = None
+        # أحدث LastModified طُبّق على القائمة؛ التحديث يجلب ما تغيّر بعده فقط
+        self.watermark = None
+        # PIL وذاكرة المعاينات لا يُحمّلان إلا عند أول صورة تُعرض
+        self._image_cache = None
         self.create_toolbar(controller)
+        # البحث أثناء الكتابة يعمل في خيط خلفي؛ search_controller.stats() يعطي زمن الاستجابة
+        self.search_controller = SearchController(self, self.query_first_page, self.apply_search,
+                                                  self.search_failed)
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(fill="both", expand=True)
-        self.add_database("Default Database")
+        self.notebook.bind("<Button-1>", self.on_tab_click)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        # القاعدة الافتراضية تُفتح بعد رسم الإطار، والمرضى يصلون صفحةً صفحة
+        self.after_idle(self.add_database, "Default Database")
 
     def create_toolbar(self , controller):
         toolbar = ttk.Frame(self)
         toolbar.pack(side="top", fill="x")
         ttk.Button(toolbar, text="الرئيسية", command=lambda: controller.show_frame("AppointmentApp")).pack(side="left", padx=5, pady=5)
-        ttk.Button(toolbar, text="تحديث", command=self.load_patients).pack(side="left", padx=5, pady=5)
+        ttk.Button(toolbar, text="تحديث", command=self.refresh_changes).pack(side="left", padx=5, pady=5)
         ttk.Button(toolbar, text="إضافة قاعدة بيانات", command=self.add_database_dialog).pack(side="left", padx=5, pady=5)
         self.search_entry = ttk.Entry(toolbar, width=30)
         self.search_entry.pack(side="left", padx=5, pady=5)
@@ -31,6 +65,77 @@ class HospitalGUI(tk.Frame):
         self.delete_btn.pack(side="left", padx=5, pady=5)
         ttk.Button(toolbar, text="استيراد", command=self.import_data).pack(side="left", padx=5, pady=5)
         ttk.Button(toolbar, text="تصدير", command=self.backup_data).pack(side="left", padx=5, pady=5)
+        ttk.Button(toolbar, text="أداء القاعدة", command=self.show_query_stats).pack(side="left", padx=5, pady=5)
+        self.stats_label = ttk.Label(toolbar)
+        self.stats_label.pack(side="right", padx=10, pady=5)
+
+    @property
+    def image_cache(self):
+        if self._image_cache is None:
+            from image_cache import ImageCache
+            self._image_cache = ImageCache(self)
+        return self._image_cache
+
+    def shutdown(self):
+        # خيوط البحث وفك المعاينات لا تعيش بعد إغلاق النافذة
+        self.search_controller.shutdown()
+        if self._image_cache is not None:
+            self._image_cache.shutdown()
+
+    def show_data_error(self, error):
+        messagebox.showerror("خطأ", getattr(error, "message", None) or str(error))
+
+    def refresh_stats(self):
+        if not self.current_hospital:
+            self.stats_label.config(text="")
+            return
+        self.current_db.get_stats(on_success=self.show_stats)
+
+    def show_stats(self, stats):
+        self.stats_label.config(
+            text=f"المرضى: {stats['live_patients']}   المحذوفون: {stats['deleted_patients']}   المواعيد: {stats['appointments']}")
+
+    # ------------------ قياس الأداء ------------------
+
+    def query_stats(self):
+        # كل ما يلزم لتشخيص "البرنامج بطيء": الجمل، العمليات، البحث والذاكرة المؤقتة
+        snapshot = STATS.snapshot()
+        snapshot["search"] = self.search_controller.stats()
+        snapshot["cache"] = self.current_hospital.cache_stats() if self.current_hospital else {}
+        return snapshot
+
+    def show_query_stats(self):
+        window = tk.Toplevel(self)
+        window.title("أداء قاعدة البيانات")
+        window.geometry("1000x600")
+        text = tk.Text(window, wrap="none", font=("Courier", 10))
+        text.pack(fill="both", expand=True)
+
+        def fill():
+            snapshot = self.query_stats()
+            extra = {"البحث": snapshot.pop("search"), "الذاكرة المؤقتة": snapshot.pop("cache")}
+            text.configure(state="normal")
+            text.delete("1.0", "end")
+            text.insert("1.0", format_report(snapshot, extra))
+            text.configure(state="disabled")
+
+        def save():
+            path = filedialog.asksaveasfilename(parent=window, defaultextension=".json",
+                                                filetypes=[("JSON", "*.json")])
+            if path:
+                with open(path, "w", encoding="utf-8") as out:
+                    json.dump(self.query_stats(), out, indent=2, ensure_ascii=False)
+
+        def reset():
+            STATS.reset()
+            fill()
+
+        buttons = ttk.Frame(window)
+        buttons.pack(fill="x")
+        ttk.Button(buttons, text="تحديث", command=fill).pack(side="left", padx=5, pady=5)
+        ttk.Button(buttons, text="حفظ", command=save).pack(side="left", padx=5, pady=5)
+        ttk.Button(buttons, text="تصفير", command=reset).pack(side="left", padx=5, pady=5)
+        fill()
 
     def add_database_dialog(self):
         db_name = filedialog.asksaveasfilename(defaultextension=".db", filetypes=[("Database Files", "*.db")])
@@ -38,13 +143,22 @@ class HospitalGUI(tk.Frame):
             self.add_database(db_name)
 
     def add_database(self, db_name):
-        hospital = Hospital(db_name)
-        self.hospitals[db_name] = hospital
+        # فتح القاعدة وترحيلها يتم خارج خيط Tk
+        self.tasks.run(Hospital, db_name, operation="open_database",
+                       on_success=lambda hospital: self.open_database(db_name, hospital))
+
+    def select_hospital(self, hospital):
         self.current_hospital = hospital
+        self.current_db = AsyncFacade(hospital, self, on_error=self.show_data_error) if hospital else None
+
+    def open_database(self, db_name, hospital):
+        self.hospitals[db_name] = hospital
+        self.select_hospital(hospital)
         tab_frame = ttk.Frame(self.notebook)
         self.notebook.add(tab_frame, text=db_name.replace("Default Database", "قاعدة البيانات الافتراضية"))
         self.notebook.select(tab_frame)
         self.create_treeview(tab_frame)
+        self.tabs[str(tab_frame)] = (db_name, hospital, self.tree, self.patients_view)
         self.add_close_button_to_tab(tab_frame, db_name)
         self.load_patients()
 
@@ -52,6 +166,8 @@ class HospitalGUI(tk.Frame):
         self.tree = ttk.Treeview(parent, columns=(
             "Select", "DisplayID", "InternalID", "FirstName", "LastName", "Age", "Gender", "Condition", "Contact", "AppointmentDate", "DateAdded", "LastModified"
         ), show="headings", style="Treeview")
+        scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self.tree.yview)
+        scrollbar.pack(side="right", fill="y")
         self.tree.pack(fill="both", expand=True)
         self.tree.heading("Select", text="اختيار")
         self.tree.column("Select", width=50, anchor="center")
@@ -82,73 +198,159 @@ class HospitalGUI(tk.Frame):
         self.tree.bind("<Button-1>", self.on_tree_click)
         self.tree.bind("<Double-1>", self.on_double_click)
         self.tree.bind("<<TreeviewSelect>>", self.on_patient_select)
+        for column in SORT_COLUMNS:
+            self.tree.heading(column, command=lambda c=column: self.sort_patients(c))
+        # الشجرة لا تحمل إلا الصفوف الظاهرة؛ البقية في نموذج VirtualTree
+        self.patients_view = VirtualTree(self.tree, scrollbar, self.fetch_patient_rows,
+                                         self.patient_values, PAGE_SIZE, order_key=lambda row: -row[0])
 
     def add_close_button_to_tab(self, tab_frame, db_name):
-        tab_index = self.notebook.index(tab_frame)
         tab_text = f"{db_name.replace('Default Database', 'قاعدة البيانات الافتراضية')}  ✖"
-        self.notebook.tab(tab_index, text=tab_text)
-
-        def close_tab(event):
-            if "✖" in self.notebook.tab(tab_index, "text"):
-                if messagebox.askyesno("تأكيد", f"إغلاق {db_name.replace('Default Database', 'قاعدة البيانات الافتراضية')}؟"):
-                    self.notebook.forget(tab_frame)
-                    del self.hospitals[db_name]
-                    if self.hospitals:
-                        self.current_hospital = next(iter(self.hospitals.values()))
-                    else:
-                        self.current_hospital = None
-            return "break"
+        self.notebook.tab(tab_frame, text=tab_text)
+
+    def on_tab_click(self, event):
+        # نقرة على تبويب آخر تنتقل إليه؛ نقرة على التبويب الظاهر تعرض إغلاقه
+        try:
+            index = self.notebook.index(f"@{event.x},{event.y}")
+        except tk.TclError:
+            return None
+        tab_frame = self.notebook.tabs()[index]
+        if tab_frame != self.notebook.select() or tab_frame not in self.tabs:
+            return None
+        db_name = self.tabs[tab_frame][0]
+        if messagebox.askyesno("تأكيد", f"إغلاق {db_name.replace('Default Database', 'قاعدة البيانات الافتراضية')}؟"):
+            self.close_tab(tab_frame)
+        return "break"
 
-        self.notebook.bind("<Button-1>", lambda e: close_tab(e))
+    def close_tab(self, tab_frame):
+        db_name = self.tabs.pop(tab_frame)[0]
+        self.hospitals.pop(db_name, None)
+        self.notebook.forget(tab_frame)
+        self.nametowidget(tab_frame).destroy()
+        if not self.tabs:
+            self.tree = self.patients_view = None
+            self.select_hospital(None)
+        # وإلا فإن <<NotebookTabChanged>> يربط التبويب الذي صار ظاهراً
+
+    def on_tab_changed(self, event=None):
+        tab = self.tabs.get(self.notebook.select())
+        if tab is None or tab[2] is self.tree:
+            return
+        _, hospital, self.tree, self.patients_view = tab
+        self.select_hospital(hospital)
+        self.load_patients()
 
     def load_patients(self):
         if not self.current_hospital:
             messagebox.showerror("خطأ", "لم يتم اختيار قاعدة بيانات")
             return
-        try:
-            df = self.current_hospital.get_all_patients()
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-            for i, row in df.iterrows():
-                display_id = i + 1
-                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-                appointment_date = row.get("AppointmentDate", "")
-                self.tree.insert("", "end", values=(
-                    "", display_id, row["ID"], row["FirstName"], row["LastName"],
-                    row["Age"], row["Gender"], "", row["Contact"],
-                    appointment_date, row["DateAdded"], row["LastModified"]
-                ), tags=(tag,))
-        except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء تحميل المرضى: {e}")
+        self.search_controller.search_now(self.search_entry.get().strip())
 
     def search_patients(self, event=None):
         if not self.current_hospital:
             messagebox.showerror("خطأ", "لم يتم اختيار قاعدة بيانات")
             return
-        search_term = self.search_entry.get().strip()
-        if not search_term:
+        self.search_controller.on_key(self.search_entry.get().strip())
+
+    def query_first_page(self, search_term, cancel):
+        # يعمل في خيط البحث: لا Tk هنا
+        hospital = self.current_hospital
+        # العلامة تُقرأ قبل الصفحة، فما يتغيّر بينهما يُلتقط في التحديث التالي
+        watermark = hospital.get_changes_watermark()
+        records, token = hospital.search_patients_page(search_term, None, PAGE_SIZE, cancel)
+        # العدد الكلي معروف مسبقاً عند عرض الكل، فيأخذ شريط التمرير حجمه الحقيقي
+        total = None if search_term else hospital.get_total_patients()
+        return hospital, [self.patient_row(record) for record in records], token, total, watermark
+
+    def apply_search(self, search_term, result):
+        hospital, rows, token, total, watermark = result
+        if hospital is not self.current_hospital:
+            return
+        self.page_search = search_term or None
+        self.watermark = watermark
+        self.patients_view.reset(total, (rows, token))
+        self.refresh_stats()
+
+    def search_failed(self, search_term, error):
+        messagebox.showerror("خطأ", f"حدث خطأ أثناء البحث: {error}")
+
+    # ------------------ التحميل على دفعات ------------------
+
+    def fetch_patient_rows(self, token, limit, done):
+        hospital, search_term = self.current_hospital, self.page_search
+
+        tree = self.tree
+
+        def fetch():
+            records, next_token = hospital.search_patients_page(search_term, token, limit)
+            return [self.patient_row(record) for record in records], next_token
+
+        # الدفعة التي تصل بعد إغلاق تبويبها تُهمل
+        def loaded(page):
+            if tree.winfo_exists():
+                done(*page)
+
+        def failed(error):
+            if tree.winfo_exists():
+                done(None, None)
+                self.show_data_error(error)
+
+        self.current_db.run(fetch, operation="fetch_patient_rows", on_success=loaded, on_error=failed)
+
+    @staticmethod
+    def patient_row(record):
+        # صف النموذج مباشرة من PatientRecord، دون المرور بـ pandas
+        return ROW_GETTER(record)
+
+    def patient_values(self, row, index, checked):
+        patient_id, first_name, last_name, age, gender, contact, date_added, last_modified = row
+        return (
+            "✔" if checked else "", index + 1, patient_id, first_name, last_name,
+            age, gender, "", "" if contact is None else contact,
+            "", date_added, last_modified
+        )
+
+    def sort_patients(self, column):
+        position = SORT_COLUMNS[column]
+        if position is None:
+            # رقم العرض يعني الترتيب الأصلي: الأحدث أولاً
+            self.patients_view.sort(0, key=lambda row: -row[0])
+        else:
+            self.patients_view.sort(position)
+
+    # ------------------ التحديث التزايدي ------------------
+
+    def refresh_changes(self):
+        # يجلب ما تغيّر منذ آخر علامة فقط، فالكلفة بعدد التغييرات لا بحجم الجدول
+        if not self.current_hospital:
+            messagebox.showerror("خطأ", "لم يتم اختيار قاعدة بيانات")
+            return
+        if self.watermark is None:
             self.load_patients()
             return
-        try:
-            df = self.current_hospital.search_patients(search_term)
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-            for i, row in df.iterrows():
-                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-                appointment_date = row.get("AppointmentDate", "")
-                self.tree.insert("", "end", values=(
-                    "", i + 1, row["ID"], row["FirstName"], row["LastName"],
-                    row["Age"], row["Gender"], row["Condition"], row["Contact"],
-                    appointment_date, row["DateAdded"], row["LastModified"]
-                ), tags=(tag,))
-        except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ أثناء البحث: {e}")
+        view = self.patients_view
+        self.current_db.get_patient_changes(self.watermark,
+                                            on_success=lambda result: self.apply_patient_changes(result, view))
+
+    def apply_patient_changes(self, result, view=None):
+        if view is not None and view is not self.patients_view:
+            return
+        records, watermark, complete = result
+        if not complete:
+            # تغييرات كثيرة (استيراد مثلاً): إعادة التحميل أرخص
+            self.load_patients()
+            return
+        self.watermark = max(self.watermark or "", watermark)
+        removed = [record.ID for record in records if record.Deleted]
+        rows = [self.patient_row(record) for record in records if not record.Deleted]
+        # نتائج البحث لا تُوسَّع بمرضى جدد؛ يظهرون في البحث التالي
+        self.patients_view.apply_changes(rows, removed, accept_new=not self.page_search)
+        self.refresh_stats()
 
     def on_tree_click(self, event):
         item = self.tree.identify_row(event.y)
-        current_value = self.tree.item(item, "values")[0]
-        new_value = "✔" if current_value != "✔" else "x"
-        self.tree.set(item, "Select", new_value)
+        if item:
+            self.patients_view.toggle_checked(item)
     
     def on_double_click(self, event):
         item = self.tree.identify_row(event.y)
@@ -157,9 +359,9 @@ class HospitalGUI(tk.Frame):
             self.open_update_patient_window()
     
     def on_patient_select(self, event):
-        selected = self.tree.selection()
-        if selected:
-            self.current_edit_id = int(self.tree.item(selected[0], "values")[2])
+        selected = self.patients_view.sync_selection()
+        if selected is not None:
+            self.current_edit_id = int(selected)
             self.delete_btn["state"] = "normal"
         else:
             self.delete_btn["state"] = "disabled"
@@ -243,6 +445,10 @@ class HospitalGUI(tk.Frame):
         
         photos_listbox = tk.Listbox(photos_frame, height=8)
         photos_listbox.pack(fill="both", expand=True, pady=(0, 10))
+        ingest_progress = ttk.Progressbar(photos_frame, mode="determinate")
+        ingest_progress.pack(fill="x", pady=(0, 10))
+        ingested = {}
+        ingest_jobs = []
         
         photos_list = []
         
@@ -251,10 +457,15 @@ class HospitalGUI(tk.Frame):
                 title="اختر الصور",
                 filetypes=[("ملفات الصور", "*.png *.jpg *.jpeg *.gif *.bmp")]
             )
+            new_paths = []
             for file_path in file_paths:
                 if file_path not in photos_list:
                     photos_list.append(file_path)
                     photos_listbox.insert(tk.END, os.path.basename(file_path))
+                    new_paths.append(file_path)
+            if new_paths:
+                self.start_photo_ingest(add_window, new_paths, photos_list, photos_listbox,
+                                        ingested, ingest_jobs, ingest_progress, save_button)
         
         def remove_photo():
             selection = photos_listbox.curselection()
@@ -267,8 +478,8 @@ class HospitalGUI(tk.Frame):
             selection = photos_listbox.curselection()
             if selection:
                 index = selection[0]
-                photo_path = photos_list[index]
-                self.show_photo_viewer(photo_path)
+                photo = photos_list[index]
+                self.show_photo_viewer(self.photo_file(photo), self.photo_name(photo))
         
         # Photo control buttons
         photo_buttons_frame = ttk.Frame(photos_frame)
@@ -292,26 +503,51 @@ class HospitalGUI(tk.Frame):
                 else:
                     data[field] = entry.get()
             
-            data["Photos"] = photos_list
             errors = self.validate_fields(data)
             if errors:
                 messagebox.showerror("خطأ", "\n".join(errors))
                 return
-            new_id = self.current_hospital.add_patient(data)
-            if new_id:
-                self.load_patients()
-                add_window.destroy()
+            hospital = self.current_hospital
+            new_photos = [ingested[p] for p in photos_list if p in ingested]
+
+            def add():
+                new_id = hospital.add_patient(data)
+                return new_id, self.save_patient_photos(hospital, new_id, new_photos, [])
+
+            def added(result):
+                new_id, photo_error = result
+                self.refresh_changes()
+                if add_window.winfo_exists():
+                    add_window.destroy()
+                if photo_error:
+                    messagebox.showerror("خطأ", f"تعذر حفظ الصور: {photo_error}")
                 messagebox.showinfo("نجاح", "تمت إضافة المريض بنجاح")
-            else:
-                messagebox.showerror("خطأ", "فشل في إضافة المريض")
+
+            def failed(error):
+                save_button.state(["!disabled"])
+                self.show_data_error(error)
+
+            save_button.state(["disabled"])
+            self.current_db.run(add, operation="add_patient", on_success=added, on_error=failed)
         
         # Save button at the bottom
-        ttk.Button(left_frame, text="حفظ المريض", command=save_patient).grid(row=len(fields), column=0, columnspan=2, pady=20)
+        save_button = ttk.Button(left_frame, text="حفظ المريض", command=save_patient)
+        save_button.grid(row=len(fields), column=0, columnspan=2, pady=20)
     
     def open_update_patient_window(self):
         if not hasattr(self, 'current_edit_id'):
             messagebox.showerror("خطأ", "لم يتم اختيار مريض")
             return
+        patient_id = self.current_edit_id
+        hospital = self.current_hospital
+        self.current_db.run(lambda: (hospital.get_patient(patient_id), hospital.list_photos(patient_id)),
+                            operation="open_patient",
+                            on_success=lambda result: self.build_update_window(patient_id, *result))
+
+    def build_update_window(self, patient_id, patient, stored_photos):
+        if patient is None:
+            messagebox.showerror("خطأ", "لم يتم العثور على المريض")
+            return
         
         update_window = tk.Toplevel(self)
         update_window.title("تحديث بيانات المريض")
@@ -338,8 +574,6 @@ class HospitalGUI(tk.Frame):
         }
         
         entries = {}
-        df = self.current_hospital.get_all_patients()
-        patient = df[df["ID"] == self.current_edit_id].iloc[0]
         
         for idx, (field, config) in enumerate(fields.items()):
             lbl = ttk.Label(left_frame, text=config["label"])
@@ -347,8 +581,8 @@ class HospitalGUI(tk.Frame):
             
             if config["type"] == "entry":
                 entry = ttk.Entry(left_frame, width=30)
-                value = str(patient.get(field, ""))
-                entry.insert(0, value)
+                value = patient.get(field, "")
+                entry.insert(0, "" if value is None else str(value))
                 entry.grid(row=idx, column=1, padx=5, pady=5, sticky="ew")
                 entries[field] = entry
             elif config["type"] == "combobox":
@@ -414,26 +648,35 @@ class HospitalGUI(tk.Frame):
         
         photos_listbox = tk.Listbox(photos_frame, height=8)
         photos_listbox.pack(fill="both", expand=True, pady=(0, 10))
+        ingest_progress = ttk.Progressbar(photos_frame, mode="determinate")
+        ingest_progress.pack(fill="x", pady=(0, 10))
+        ingested = {}
+        ingest_jobs = []
         
-        # Load existing photos
+        # Load existing photos: managed store first, then any legacy paths still in the Photos column
         try:
-            existing_photos = json.loads(patient.get("Photos", "[]"))
+            legacy_photos = json.loads(patient.get("Photos", "[]"))
         except (json.JSONDecodeError, TypeError):
-            existing_photos = []
+            legacy_photos = []
         
-        photos_list = existing_photos.copy()
-        for photo_path in photos_list:
-            photos_listbox.insert(tk.END, os.path.basename(photo_path))
+        photos_list = stored_photos + legacy_photos
+        for photo in photos_list:
+            photos_listbox.insert(tk.END, self.photo_name(photo))
         
         def add_photo():
             file_paths = filedialog.askopenfilenames(
                 title="اختر الصور",
                 filetypes=[("ملفات الصور", "*.png *.jpg *.jpeg *.gif *.bmp")]
             )
+            new_paths = []
             for file_path in file_paths:
                 if file_path not in photos_list:
                     photos_list.append(file_path)
                     photos_listbox.insert(tk.END, os.path.basename(file_path))
+                    new_paths.append(file_path)
+            if new_paths:
+                self.start_photo_ingest(update_window, new_paths, photos_list, photos_listbox,
+                                        ingested, ingest_jobs, ingest_progress, save_button)
         
         def remove_photo():
             selection = photos_listbox.curselection()
@@ -446,8 +689,8 @@ class HospitalGUI(tk.Frame):
             selection = photos_listbox.curselection()
             if selection:
                 index = selection[0]
-                photo_path = photos_list[index]
-                self.show_photo_viewer(photo_path)
+                photo = photos_list[index]
+                self.show_photo_viewer(self.photo_file(photo), self.photo_name(photo))
         
         # Photo control buttons
         photo_buttons_frame = ttk.Frame(photos_frame)
@@ -471,41 +714,117 @@ class HospitalGUI(tk.Frame):
                 else:
                     data[field] = entry.get()
             
-            data["Photos"] = photos_list
+            data["Photos"] = [p for p in photos_list if p in legacy_photos]
             errors = self.validate_fields(data)
             if errors:
                 messagebox.showerror("خطأ", "\n".join(errors))
                 return
-            if self.current_hospital.update_patient(self.current_edit_id, data):
-                self.load_patients()
-                update_window.destroy()
+            hospital = self.current_hospital
+            new_photos = [ingested[p] for p in photos_list if isinstance(p, str) and p in ingested]
+            removed = [p.ID for p in stored_photos if p not in photos_list]
+
+            def update():
+                if not hospital.update_patient(patient_id, data):
+                    return False, None
+                return True, self.save_patient_photos(hospital, patient_id, new_photos, removed)
+
+            def updated(result):
+                ok, photo_error = result
+                save_button.state(["!disabled"])
+                if not ok:
+                    messagebox.showerror("خطأ", "لم يتم العثور على المريض")
+                    return
+                self.refresh_changes()
+                if update_window.winfo_exists():
+                    update_window.destroy()
+                if photo_error:
+                    messagebox.showerror("خطأ", f"تعذر حفظ الصور: {photo_error}")
                 messagebox.showinfo("نجاح", "تم تحديث بيانات المريض")
+
+            def failed(error):
+                save_button.state(["!disabled"])
+                self.show_data_error(error)
+
+            save_button.state(["disabled"])
+            self.current_db.run(update, operation="update_patient", on_success=updated, on_error=failed)
         
         # Save button at the bottom
-        ttk.Button(left_frame, text="تحديث بيانات المريض", command=save_update).grid(row=len(fields), column=0, columnspan=2, pady=20)
+        save_button = ttk.Button(left_frame, text="تحديث بيانات المريض", command=save_update)
+        save_button.grid(row=len(fields), column=0, columnspan=2, pady=20)
     
-    def show_photo_viewer(self, photo_path):
+    # ------------------ الصور ------------------
+
+    def photo_name(self, photo):
+        return photo.OriginalName if isinstance(photo, PhotoRecord) else os.path.basename(photo)
+
+    def photo_file(self, photo):
+        return self.current_hospital.photo_path(photo) if isinstance(photo, PhotoRecord) else photo
+
+    def start_photo_ingest(self, window, file_paths, photos_list, photos_listbox,
+                           ingested, ingest_jobs, progress, save_button):
+        # الصور تُعالج في عمليات خلفية؛ الحفظ معطّل حتى تنتهي كل الدفعات
+        save_button.state(["disabled"])
+
+        def on_progress(done, total):
+            if window.winfo_exists():
+                progress.configure(maximum=total, value=done)
+
+        def on_done(results, errors):
+            if not window.winfo_exists():
+                return
+            ingested.update(results)
+            for path in errors:
+                if path in photos_list:
+                    index = photos_list.index(path)
+                    photos_list.pop(index)
+                    photos_listbox.delete(index)
+            if all(job.done for job in ingest_jobs):
+                save_button.state(["!disabled"])
+            if errors:
+                names = "\n".join(os.path.basename(p) for p in errors)
+                messagebox.showerror("خطأ", f"تعذرت قراءة الصور التالية:\n{names}", parent=window)
+
+        from photo_ingest import PhotoIngestJob
+        ingest_jobs.append(PhotoIngestJob(self, self.current_hospital, file_paths, on_progress, on_done))
+
+    @staticmethod
+    def save_patient_photos(hospital, patient_id, new_photos, removed_ids):
+        # يعمل في خيط خلفي؛ كل الصور الجديدة تُسجّل في معاملة واحدة
+        # الخطأ يُعاد ولا يُرفع، فبيانات المريض المحفوظة قبله تبقى
+        try:
+            if new_photos:
+                hospital.save_photo_records(patient_id, new_photos)
+            if removed_ids:
+                hospital.detach_photos(removed_ids)
+        except Exception as e:
+            return e
+        return None
+
+    def show_photo_viewer(self, photo_path, title=None):
         """Display photo in a new window"""
         if not os.path.exists(photo_path):
             messagebox.showerror("خطأ", "ملف الصورة غير موجود")
             return
         
-        photo_window = tk.Toplevel(self.root)
-        photo_window.title(f"Photo: {os.path.basename(photo_path)}")
+        photo_window = tk.Toplevel(self)
+        photo_window.title(f"Photo: {title or os.path.basename(photo_path)}")
         photo_window.geometry("600x600")
+        label = ttk.Label(photo_window, text="جاري تحميل الصورة...")
+        label.pack(expand=True)
         
-        try:
-            image = Image.open(photo_path)
-            # Resize to fit window while maintaining aspect ratio
-            image.thumbnail((550, 550), Image.Resampling.LANCZOS)
-            photo = ImageTk.PhotoImage(image)
-            
-            label = ttk.Label(photo_window, image=photo)
+        def show(photo, error):
+            if not photo_window.winfo_exists():
+                return
+            if error is not None:
+                messagebox.showerror("خطأ", f"لا يمكن عرض الصورة: {error}")
+                photo_window.destroy()
+                return
+            label.configure(image=photo, text="")
             label.image = photo  # Keep a reference
-            label.pack(expand=True)
-        except Exception as e:
-            messagebox.showerror("خطأ", f"لا يمكن عرض الصورة: {e}")
-            photo_window.destroy()
+        
+        # المعاينة من الذاكرة أو القرص إن وُجدت، وإلا تُفك في الخلفية دون تجميد الواجهة
+        disk_root = self.current_hospital.photo_store.preview_root if self.current_hospital else None
+        self.image_cache.request(photo_path, show, disk_root=disk_root)
     
     def validate_fields(self, data):
         errors = []
@@ -541,31 +860,56 @@ class HospitalGUI(tk.Frame):
         if  self.current_hospital is None:
             messagebox.showerror("خطأ", "لم يتم اختيار قاعدة بيانات")
             return
-        #self.tree.item(selected[0], "values")[2]
-        selected_items = [item for item in self.tree.get_children() if self.tree.item(item, "values")[0] == "✔"]
-        if len(selected_items) > 0:
-            if messagebox.askyesno("تأكيد", f"حذف {len(selected_items)} مريض؟"):
-                for item in selected_items:
-                    patient_id = int(self.tree.item(item, "values")[2])
-                    self.current_hospital.delete_patient(patient_id)
-                self.load_patients()
+        # المؤشَّر عليهم محفوظون في النموذج، حتى من مرّروا خارج النافذة الظاهرة
+        patient_ids = sorted(self.patients_view.checked)
+        if len(patient_ids) > 0:
+            if messagebox.askyesno("تأكيد", f"حذف {len(patient_ids)} مريض؟"):
+                self.current_db.delete_patients(patient_ids, on_success=lambda deleted: self.refresh_changes())
         else:
             messagebox.showinfo("معلومات", "لم يتم اختيار أي مريض للحذف")
-    
+
     def backup_data(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".xlsx")
+        # الصيغ التي حزمها مثبتة فقط (Parquet يحتاج pyarrow)
+        from data_io import export_formats
+        formats = export_formats()
+        names = {".xlsx": "Excel files", ".csv": "CSV files", ".parquet": "Parquet files"}
+        file_path = filedialog.asksaveasfilename(defaultextension=formats[0], filetypes=[
+            (names[extension], "*" + extension) for extension in formats])
         if file_path:
-            self.current_hospital.export_data(file_path)
-            messagebox.showinfo("نجاح", "تم إنشاء النسخة الاحتياطية")
+            def exported(count):
+                self.reset_title()
+                messagebox.showinfo("نجاح", f"تم إنشاء النسخة الاحتياطية ({count} مريض)")
+
+            def failed(error):
+                self.reset_title()
+                messagebox.showerror("خطأ", f"حدث خطأ أثناء التصدير: {error}")
+
+            self.current_db.export_data(file_path, progress=self.current_db.tk_callback(self.show_export_progress),
+                                        on_success=exported, on_error=failed)
+
+    def reset_title(self):
+        self.master.winfo_toplevel().title("نظام إدارة المستشفى")
+
+    def show_export_progress(self, exported):
+        self.master.winfo_toplevel().title(f"جاري التصدير... {exported} صف")
     
     def import_data(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
+        file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv")])
         if file_path:
-            try:
-                if self.current_hospital.import_data(file_path):
-                    self.load_patients()
-                    messagebox.showinfo("نجاح", "تم استيراد البيانات بنجاح")
-                else:
-                    messagebox.showerror("خطأ", "فشل في استيراد البيانات. يرجى التحقق من تنسيق الملف.")
-            except Exception as e:
-                messagebox.showerror("خطأ", f"حدث خطأ أثناء الاستيراد: {e}")
+            def imported(result):
+                self.reset_title()
+                self.refresh_changes()
+                message = f"تم استيراد {result['imported']} مريض بنجاح"
+                if result["rejected"]:
+                    message += f"\nتم رفض {result['rejected']} صف، انظر الملف:\n{result['reject_file']}"
+                messagebox.showinfo("نجاح", message)
+
+            def failed(error):
+                self.reset_title()
+                self.show_data_error(error)
+
+            self.current_db.import_data(file_path, progress=self.current_db.tk_callback(self.show_import_progress),
+                                        on_success=imported, on_error=failed)
+
+    def show_import_progress(self, done, imported, rejected):
+        self.master.winfo_toplevel().title(f"جاري الاستيراد... {done} صف ({rejected} مرفوض)")
@@ -0,0 +1,115 @@
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import DataError, READERS_PER_DB
+
+# واجهة غير متزامنة فوق Hospital و Appointment:
+#   - كل استدعاء يعمل في خيط من مجمع مشترك ويعيد Future (يقبل asyncio.wrap_future)
+#   - النتيجة أو الخطأ (DataError) تصل إلى دوال الرد في خيط Tk عبر طابور يُقرأ بـ after()
+#   - خيط Tk لا يلمس SQLite إطلاقاً
+
+POLL_MS = 20
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # كاتب واحد في المجمع، فالخيوط الإضافية تخدم القراءات المتوازية
+            _executor = ThreadPoolExecutor(max_workers=READERS_PER_DB, thread_name_prefix="db")
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+class AsyncFacade:
+    """Run the methods of a data object off the Tk thread.
+
+    facade.add_patient(data, on_success=..., on_error=...) submits target.add_patient(data)
+    and returns its Future; on_success(result) or on_error(DataError) then runs on the Tk thread.
+    """
+
+    def __init__(self, target, widget, on_error=None):
+        self.target = target
+        self.widget = widget
+        self.on_error = on_error
+        self._results = queue.Queue()
+        self._pending = 0
+        self._polling = False
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+        return functools.partial(self.call, name)
+
+    def call(self, method, *args, on_success=None, on_error=None, **kwargs):
+        return self.run(getattr(self.target, method), *args,
+                        on_success=on_success, on_error=on_error, operation=method, **kwargs)
+
+    def run(self, fn, *args, on_success=None, on_error=None, operation=None, **kwargs):
+        """Submit fn(*args, **kwargs); fn may chain several calls on the data object."""
+        operation = operation or getattr(fn, "__name__", "run")
+
+        def job():
+            try:
+                return fn(*args, **kwargs)
+            except DataError as e:
+                if e.operation is None:
+                    e.operation = operation
+                raise
+            except Exception as e:
+                raise DataError(str(e), operation) from e
+
+        future = get_executor().submit(job)
+        self._pending += 1
+        future.add_done_callback(lambda f: self._results.put((f, on_success, on_error)))
+        self._start_polling()
+        return future
+
+    def tk_callback(self, fn):
+        """Wrap fn so that calling it from a worker (e.g. a progress hook) runs it on the Tk thread."""
+        def post(*args):
+            self._results.put((None, fn, args))
+        return post
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.widget.after(POLL_MS, self._poll)
+
+    def _poll(self):
+        while True:
+            try:
+                future, callback, extra = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if future is None:
+                callback(*extra)
+                continue
+            self._pending -= 1
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                if callback:
+                    callback(future.result())
+            else:
+                handler = extra or self.on_error
+                if handler:
+                    handler(error)
+        if self._pending:
+            self.widget.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
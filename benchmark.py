@@ -0,0 +1,412 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from utils import dbSession, normalizeContact, closeAllDbs, canonicalDateTime
+from migrations import migrate
+from HospitalClass1 import Hospital
+from AppointmentClass import Appointment
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# قياس أداء عمليات Hospital و Appointment على قواعد اصطناعية قابلة للتكرار:
+#   - أسماء عربية ولاتينية، بحجم 10k و 100k و 1M مريض ونحو 10 مواعيد لكل مريض
+#   - كل حالة تُكرر وتُسجّل p50 و p95 بالمللي ثانية وذروة الذاكرة المقيمة (RSS)
+#   - المقارنة مع ملف أساس JSON تُظهر التراجعات قبل الإصدار
+# القواعد المبنية تُحفظ كقوالب في --data-dir، وكل تشغيل يعمل على نسخة منها.
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_SIZES = ("10k", "100k", "1m")
+APPOINTMENTS_PER_PATIENT = 10
+BUILD_BATCH = 10_000
+IMPORT_ROWS = 1000
+PHOTO_BYTES = 200 * 1024
+REPEAT = 30
+HEAVY_REPEAT = 3
+TOLERANCE = 0.20
+# فروق أصغر من هذا ضجيج قياس وليست تراجعاً
+MIN_DELTA_MS = 1.0
+BASE_DATE = datetime(2020, 1, 1)
+
+FIRST_NAMES_AR = ["محمد", "أحمد", "فاطمة", "خديجة", "يوسف", "عائشة", "علي", "مريم", "عمر", "سارة",
+                  "إبراهيم", "زينب", "حسن", "نور", "خالد", "ليلى", "عبد الرحمن", "هدى", "مصطفى", "أمينة"]
+LAST_NAMES_AR = ["علي", "حداد", "بوزيد", "سعيدي", "منصوري", "قاسمي", "عبد الله", "شريف", "بلقاسم",
+                 "زروقي", "العمري", "بن يوسف", "مرابط", "بوعلام", "الهاشمي"]
+FIRST_NAMES_LATIN = ["Mohamed", "Ahmed", "Fatima", "Karim", "Yacine", "Sara", "Amine", "Lina", "Omar",
+                     "Nadia", "Sofiane", "Meriem", "Walid", "Imane", "Riad", "Samira"]
+LAST_NAMES_LATIN = ["Benali", "Haddad", "Bouzid", "Saidi", "Mansouri", "Kaci", "Cherif", "Belkacem",
+                    "Zerrouki", "Brahimi", "Amrani", "Benyoucef", "Rahmani", "Hamidi", "Ouali"]
+LAST_NAME_PREFIXES_AR = ["", "بن ", "آل "]
+LAST_NAME_PREFIXES_LATIN = ["", "Ben ", "Ait "]
+CONDITIONS = ["تسوس", "التهاب اللثة", "Extraction", "Détartrage", "تقويم", "Contrôle", "حشوة", "Couronne"]
+GENDERS = ["ذكر", "أنثى"]
+
+
+# ------------------ الذاكرة ------------------
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None when it cannot be read."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS يعطي البايتات، ولينكس الكيلوبايتات
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil  # اختياري: على ويندوز فقط
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# ------------------ البيانات الاصطناعية ------------------
+
+def fake_patient(rng, patient_id, added):
+    if rng.random() < 0.5:
+        first, last = rng.choice(FIRST_NAMES_AR), rng.choice(LAST_NAME_PREFIXES_AR) + rng.choice(LAST_NAMES_AR)
+    else:
+        first, last = rng.choice(FIRST_NAMES_LATIN), rng.choice(LAST_NAME_PREFIXES_LATIN) + rng.choice(LAST_NAMES_LATIN)
+    digits = f"0{rng.choice('567')}{rng.randrange(10 ** 8):08d}"
+    # صيغ مختلفة لنفس الرقم، كما يكتبها المستخدمون
+    contact = rng.choice([digits, f"{digits[:4]} {digits[4:6]} {digits[6:8]} {digits[8:]}", "+213" + digits[1:]])
+    stamp = added.strftime("%Y-%m-%d %H:%M:%S")
+    return (patient_id, first, last, rng.randint(1, 95), rng.choice(GENDERS), contact,
+            normalizeContact(contact), "[]", stamp, stamp)
+
+
+def fake_appointments(rng, patient_id, added):
+    rows = []
+    day = added
+    for _ in range(rng.randint(APPOINTMENTS_PER_PATIENT // 2, APPOINTMENTS_PER_PATIENT * 3 // 2)):
+        day += timedelta(days=rng.randint(1, 120))
+        next_day = (day + timedelta(days=rng.randint(7, 60))).strftime("%Y-%m-%d") if rng.random() < 0.5 else ""
+        # نصف المواعيد بوقت محدد، كما تكتبها شاشة المواعيد
+        text = day.strftime("%Y-%m-%d %H:%M" if rng.random() < 0.5 else "%Y-%m-%d")
+        rows.append((patient_id, text, rng.choice(CONDITIONS), "", "", "", next_day,
+                     *canonicalDateTime(text), *canonicalDateTime(next_day)))
+    return rows
+
+
+def build_database(db_file, patients, seed=42, progress=None):
+    """Create db_file with the given number of synthetic patients; same seed, same data."""
+    rng = random.Random(seed)
+    migrate(db_file)
+    # المرضى مرتبون زمنياً كما في قاعدة حقيقية: ID الأكبر هو الأحدث
+    spread = (datetime(2026, 1, 1) - BASE_DATE).total_seconds() / max(1, patients)
+    for start in range(0, patients, BUILD_BATCH):
+        patient_rows, appointment_rows = [], []
+        for patient_id in range(start + 1, min(patients, start + BUILD_BATCH) + 1):
+            added = BASE_DATE + timedelta(seconds=int(patient_id * spread))
+            patient_rows.append(fake_patient(rng, patient_id, added))
+            appointment_rows.extend(fake_appointments(rng, patient_id, added))
+        with dbSession(db_file) as (conn, cursor):
+            cursor.executemany("""
+                INSERT INTO patients (ID, FirstName, LastName, Age, Gender, Contact, ContactNorm, Photos,
+                                      DateAdded, LastModified)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, patient_rows)
+            cursor.executemany("""
+                INSERT INTO appointments (PatientID, AppointmentDate, Condition, Treatment, Symptoms, Notes,
+                                          NextAppointment, AppointmentISO, AppointmentTs, NextAppointmentISO,
+                                          NextAppointmentTs)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, appointment_rows)
+        if progress:
+            progress(min(patients, start + BUILD_BATCH), patients)
+    with dbSession(db_file) as (conn, cursor):
+        cursor.execute("ANALYZE")
+    closeAllDbs()
+
+
+def template_path(data_dir, size, seed):
+    return os.path.join(data_dir, f"bench-{size}-{seed}.db")
+
+
+def prepare_database(data_dir, size, seed, work_dir, rebuild=False):
+    """Copy (building first if needed) the template for size into work_dir; returns (path, build_s)."""
+    template = template_path(data_dir, size, seed)
+    build_s = None
+    if rebuild or not os.path.exists(template):
+        os.makedirs(data_dir, exist_ok=True)
+        partial = template + ".part"
+        for path in (partial, partial + "-wal", partial + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        started = time.perf_counter()
+        build_database(partial, SIZES[size], seed,
+                       lambda done, total: print(f"  {size}: {done}/{total}", end="\r", flush=True))
+        build_s = time.perf_counter() - started
+        os.replace(partial, template)
+        print()
+    work_file = os.path.join(work_dir, os.path.basename(template))
+    shutil.copyfile(template, work_file)
+    return work_file, build_s
+
+
+def write_photo_files(work_dir, rng, count, size=PHOTO_BYTES):
+    # محتوى مختلف لكل ملف، فلا يختصر المخزن النسخ بالبصمة
+    paths = []
+    for i in range(count):
+        path = os.path.join(work_dir, f"photo-{i}.jpg")
+        with open(path, "wb") as out:
+            out.write(rng.randbytes(size))
+        paths.append(path)
+    return paths
+
+
+def write_import_file(path, rng, rows=IMPORT_ROWS):
+    with open(path, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["FirstName", "LastName", "Age", "Gender", "Contact"])
+        for i in range(rows):
+            _, first, last, age, gender, contact, *_ = fake_patient(rng, i, BASE_DATE)
+            writer.writerow([first, last, age, gender, contact])
+
+
+# ------------------ الحالات ------------------
+
+def benchmark_cases(hospital, appointments, rng, work_dir):
+    """[(name, fn, repeat)] covering the public Hospital and Appointment methods, reads before writes.
+
+    Not measured: import_legacy_photos (the synthetic data has no legacy photo paths), the pure helpers
+    encode/decode_page_token, week_bounds and photo_path, and setup_database (reported as open_ms).
+    """
+    with dbSession(hospital.db_file, readonly=True) as (conn, cursor):
+        cursor.execute("SELECT MAX(ID) FROM patients")
+        max_id = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(ID) FROM appointments")
+        max_appointment = cursor.fetchone()[0]
+    sample_ids = [rng.randint(1, max_id) for _ in range(REPEAT)]
+    patients = hospital.get_patients(sample_ids)
+    sample = [patients[i] for i in sample_ids if i in patients]
+    terms = [rng.choice(FIRST_NAMES_AR), rng.choice(LAST_NAMES_LATIN), sample[0].Contact[:6], "Sa", "zzzzzz"]
+    deep_token = hospital.encode_page_token(max_id // 2)
+    watermark = hospital.get_changes_watermark()
+    day = (BASE_DATE + timedelta(days=400)).strftime("%Y-%m-%d")
+    picks = iter(lambda: rng.choice(sample), None)
+    import_file = os.path.join(work_dir, "import.csv")
+    write_import_file(import_file, rng)
+    export_file = os.path.join(work_dir, "export.csv")
+    # تشغيل التسخين يأخذ ملفاً إضافياً
+    photo_files = iter(write_photo_files(work_dir, rng, REPEAT + 1))
+    some_patients = lambda count: rng.sample(range(1, max_id + 1), count)
+    some_appointments = lambda count: rng.sample(range(1, max_appointment + 1), count)
+
+    def cold_all_patients():
+        hospital.result_cache.clear()
+        return hospital.get_all_patients(copy=False)
+
+    def cold_get_patient():
+        hospital.invalidate_patients()
+        return hospital.get_patient(next(picks).ID)
+
+    reads = [
+        ("get_stats", hospital.get_stats, REPEAT),
+        ("get_total_patients", hospital.get_total_patients, REPEAT),
+        ("list_patients_page", lambda: hospital.list_patients_page(None, 50), REPEAT),
+        ("list_patients_page_deep", lambda: hospital.list_patients_page(deep_token, 50), REPEAT),
+        ("list_patients_page_frame", lambda: hospital.list_patients_page(None, 50, as_frame=True), REPEAT),
+    ]
+    for i, term in enumerate(terms):
+        reads.append((f"search_patients[{i}]", lambda term=term: hospital.search_patients(term), REPEAT))
+        reads.append((f"search_patients_page[{i}]", lambda term=term: hospital.search_patients_page(term, None, 50),
+                      REPEAT))
+    reads += [
+        ("get_all_patients_cold", cold_all_patients, HEAVY_REPEAT),
+        ("get_all_patients_warm", lambda: hospital.get_all_patients(copy=False), HEAVY_REPEAT),
+        ("get_all_patients_copy", hospital.get_all_patients, HEAVY_REPEAT),
+        ("get_patient_cold", cold_get_patient, REPEAT),
+        ("get_patient_warm", lambda: hospital.get_patient(sample[0].ID), REPEAT),
+        ("get_patients", lambda: hospital.get_patients(sample_ids), REPEAT),
+        ("find_patient_by_contact", lambda: hospital.find_patient_by_contact(next(picks).Contact), REPEAT),
+        ("find_patients_by_last_name", lambda: hospital.find_patients_by_last_name(next(picks).LastName), REPEAT),
+        ("find_patient_by_contact_or_lastname",
+         lambda: hospital.find_patient_by_contact_or_lastname("", next(picks).LastName), REPEAT),
+        ("get_changes_watermark", hospital.get_changes_watermark, REPEAT),
+        ("get_patient_changes", lambda: hospital.get_patient_changes(watermark), REPEAT),
+        ("list_photos", lambda: hospital.list_photos(next(picks).ID), REPEAT),
+        ("hospital.get_appointments_by_patient", lambda: hospital.get_appointments_by_patient(next(picks).ID),
+         REPEAT),
+        ("get_appointments_by_patient", lambda: appointments.get_appointments_by_patient(next(picks).ID), REPEAT),
+        ("get_all_appointments", lambda: appointments.get_all_appointments(100), REPEAT),
+        ("appointments.count", appointments.count, REPEAT),
+        ("count_for_patient", lambda: appointments.count_for_patient(next(picks).ID), REPEAT),
+        ("count_for_day", lambda: appointments.count_for_day(day), REPEAT),
+        ("daily_counts", lambda: appointments.daily_counts("2020-01-01", "2026-12-31"), REPEAT),
+        ("get_appointments_between_day", lambda: appointments.get_appointments_between(
+            day, (BASE_DATE + timedelta(days=401)).strftime("%Y-%m-%d")), REPEAT),
+        ("get_appointments_between_week", lambda: appointments.get_appointments_between(
+            day, (BASE_DATE + timedelta(days=407)).strftime("%Y-%m-%d")), REPEAT),
+        ("get_day_schedule", lambda: appointments.get_day_schedule(day), REPEAT),
+        ("get_week_schedule", lambda: appointments.get_week_schedule(day), REPEAT),
+        ("week_summary", lambda: appointments.week_summary(day), REPEAT),
+        ("schedule_summary_month", lambda: appointments.schedule_summary(
+            day, (BASE_DATE + timedelta(days=430)).strftime("%Y-%m-%d")), REPEAT),
+        ("followup_counts", lambda: appointments.followup_counts(day), REPEAT),
+        ("get_due_followups_day", lambda: appointments.get_due_followups(day), REPEAT),
+        ("get_due_followups_week", lambda: appointments.get_due_followups(
+            day, (BASE_DATE + timedelta(days=407)).strftime("%Y-%m-%d")), REPEAT),
+        ("get_overdue_followups", lambda: appointments.get_overdue_followups(day, limit=500), REPEAT),
+        ("export_data", lambda: hospital.export_data(export_file), HEAVY_REPEAT),
+    ]
+    new_ids = []
+    attached = []
+    writes = [
+        ("add_patient", lambda: new_ids.append(hospital.add_patient(
+            {"FirstName": "Test", "LastName": "Bench", "Age": 30, "Gender": "ذكر", "Contact": "0550000000"})),
+         REPEAT),
+        ("update_patient", lambda: hospital.update_patient(new_ids[-1], {
+            "FirstName": "Test", "LastName": "Bench2", "Age": 31, "Gender": "ذكر", "Contact": "0550000001"}),
+         REPEAT),
+        ("update_patients", lambda: hospital.update_patients({i: {"Age": 40} for i in new_ids[:10]}), REPEAT),
+        ("update_patients_batch", lambda: hospital.update_patients({i: {"Age": 41} for i in some_patients(100)}),
+         REPEAT),
+        ("add_appointment", lambda: appointments.add_appointment(new_ids[-1], {"AppointmentDate": day}), REPEAT),
+        ("update_appointment", lambda: appointments.update_appointment(
+            rng.randint(1, max_appointment), {"AppointmentDate": day, "Condition": "Contrôle"}), REPEAT),
+        ("hospital.add_appointment", lambda: hospital.add_appointment(new_ids[-1], {"AppointmentDate": day}),
+         REPEAT),
+        ("hospital.update_appointment", lambda: hospital.update_appointment(
+            rng.randint(1, max_appointment), {"AppointmentDate": day, "Condition": "Contrôle"}), REPEAT),
+        ("attach_photos", lambda: attached.extend(hospital.attach_photos(sample[0].ID, [next(photo_files)])),
+         REPEAT),
+        ("open_photo", lambda: hospital.open_photo(attached[-1]).close(), REPEAT),
+        ("list_photos_attached", lambda: hospital.list_photos(sample[0].ID), REPEAT),
+        ("detach_photos", lambda: hospital.detach_photos([attached.pop().ID]), REPEAT // 2),
+        ("dismiss_followup", lambda: appointments.dismiss_followup(next(picks).ID), REPEAT),
+        ("delete_appointment", lambda: appointments.delete_appointment(some_appointments(1)[0]), REPEAT),
+        ("hospital.delete_appointment", lambda: hospital.delete_appointment(some_appointments(1)[0]), REPEAT),
+        ("delete_appointments", lambda: appointments.delete_appointments(some_appointments(10)), REPEAT),
+        ("delete_patients", lambda: hospital.delete_patients([new_ids.pop()]), REPEAT // 2),
+        ("delete_patient", lambda: hospital.delete_patient(some_patients(1)[0]), REPEAT),
+        ("delete_patients_batch", lambda: hospital.delete_patients(some_patients(10)), REPEAT),
+        ("import_data", lambda: hospital.import_data(import_file), HEAVY_REPEAT),
+        # صيانة: إعادة بناء ما تحفظه المشغّلات من الصفر
+        ("rebuild_stats", hospital.rebuild_stats, HEAVY_REPEAT),
+        ("rebuild_search_index", hospital.rebuild_search_index, HEAVY_REPEAT),
+        ("backfill_dates", appointments.backfill_dates, HEAVY_REPEAT),
+    ]
+    return reads + writes
+
+
+def run_case(fn, repeat):
+    # تشغيل أول غير محسوب: استيرادات كسولة وتسخين ذاكرة SQLite
+    fn()
+    rss_before = peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    rss_after = peak_rss_mb()
+    return {
+        "runs": len(timings),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "peak_rss_mb": None if rss_after is None else round(rss_after, 1),
+        "rss_growth_mb": None if rss_after is None else round(rss_after - rss_before, 1),
+    }
+
+
+def run_size(size, seed, data_dir, only=None, rebuild=False):
+    with tempfile.TemporaryDirectory(prefix="bench-") as work_dir:
+        db_file, build_s = prepare_database(data_dir, size, seed, work_dir, rebuild)
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        hospital = Hospital(db_file)
+        appointments = Appointment(db_file)
+        result = {"patients": SIZES[size], "build_s": None if build_s is None else round(build_s, 1),
+                  "open_ms": round((time.perf_counter() - started) * 1000, 3), "cases": {}}
+        try:
+            for name, fn, repeat in benchmark_cases(hospital, appointments, rng, work_dir):
+                if only and not any(part in name for part in only):
+                    continue
+                case = result["cases"][name] = run_case(fn, repeat)
+                print(f"  {size:>5} {name:<40} p50 {case['p50_ms']:10.3f}  p95 {case['p95_ms']:10.3f} ms"
+                      f"  rss {case['peak_rss_mb']} MB", flush=True)
+        finally:
+            closeAllDbs()
+        return result
+
+
+# ------------------ المقارنة ------------------
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """[(size, case, metric, baseline, current, ratio)] for every metric that got worse than tolerance."""
+    regressions = []
+    for size, current in results["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if not base:
+            continue
+        for name, case in current["cases"].items():
+            old = base["cases"].get(name)
+            if not old:
+                continue
+            for metric, min_delta in (("p50_ms", MIN_DELTA_MS), ("p95_ms", MIN_DELTA_MS), ("peak_rss_mb", 1.0)):
+                before, after = old.get(metric), case.get(metric)
+                if before is None or after is None:
+                    continue
+                if after - before > min_delta and after > before * (1 + tolerance):
+                    regressions.append((size, name, metric, before, after, after / before if before else None))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Hospital and Appointment on synthetic databases")
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZES), default=list(DEFAULT_SIZES))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default="bench-data", help="where the generated templates are kept")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the templates")
+    parser.add_argument("--only", nargs="+", help="run only the cases whose name contains one of these")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with a results JSON saved earlier")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "sizes": {},
+    }
+    for size in args.sizes:
+        print(f"{size}:")
+        results["sizes"][size] = run_size(size, args.seed, args.data_dir, args.only, args.rebuild)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as out:
+            json.dump(results, out, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for size, name, metric, before, after, ratio in regressions:
+            factor = "n/a" if ratio is None else f"x{ratio:.2f}"
+            print(f"تراجع {size} {name} {metric}: {before} -> {after} ({factor})")
+        if regressions:
+            return 1
+        print("لا تراجع مقارنة بالأساس")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import csv
+import importlib.util
+import json
+import os
+
+import pandas as pd
+
+from utils import dbSession, normalizeContact, DataError
+
+# استيراد وتصدير المرضى على دفعات بذاكرة ثابتة مهما كان حجم الملف
+
+REQUIRED_COLUMNS = ["FirstName", "LastName", "Age", "Gender"]
+IMPORT_COLUMNS = REQUIRED_COLUMNS + ["Contact"]
+CHUNK_SIZE = 5000
+
+GENDERS = {
+    "ذكر": "ذكر", "m": "ذكر", "male": "ذكر", "h": "ذكر", "homme": "ذكر",
+    "أنثى": "أنثى", "انثى": "أنثى", "f": "أنثى", "female": "أنثى", "femme": "أنثى",
+}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+# ------------------ القراءة ------------------
+
+def iter_excel_chunks(file_path, chunk_size=CHUNK_SIZE):
+    from openpyxl import load_workbook
+
+    # read_only يقرأ الأوراق كتدفق XML دون تحميل الملف كاملاً
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h).strip() if h is not None else "" for h in header]
+        chunk = []
+        for row in rows:
+            if row is None or all(v is None for v in row):
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=header, dtype=object)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header, dtype=object)
+    finally:
+        workbook.close()
+
+
+def iter_csv_chunks(file_path, chunk_size=CHUNK_SIZE):
+    reader = pd.read_csv(file_path, chunksize=chunk_size, dtype=str,
+                         keep_default_na=False, encoding="utf-8-sig")
+    for chunk in reader:
+        chunk.columns = [str(c).strip() for c in chunk.columns]
+        yield chunk
+
+
+def iter_chunks(file_path, chunk_size=CHUNK_SIZE):
+    if file_path.lower().endswith((".csv", ".txt")):
+        return iter_csv_chunks(file_path, chunk_size)
+    return iter_excel_chunks(file_path, chunk_size)
+
+
+# ------------------ التحقق ------------------
+
+def _text(series):
+    return series.where(series.notna(), "").astype(str).str.strip()
+
+
+def validate_chunk(df):
+    """Split a raw chunk into clean rows and rejected rows (with a reason)."""
+    first = _text(df["FirstName"])
+    last = _text(df["LastName"])
+    age = pd.to_numeric(df["Age"], errors="coerce")
+    gender = _text(df["Gender"]).str.lower().map(GENDERS)
+    contact = _text(df["Contact"]) if "Contact" in df.columns else pd.Series("", index=df.index)
+    contact = contact.str.replace(r"\.0$", "", regex=True)
+
+    reason = pd.Series("", index=df.index, dtype=object)
+    reason = reason.mask(first == "", "FirstName فارغ")
+    reason = reason.mask((reason == "") & (last == ""), "LastName فارغ")
+    bad_age = age.isna() | (age < 0) | (age > 150) | (age.fillna(0) % 1 != 0)
+    reason = reason.mask((reason == "") & bad_age, "Age غير صالح")
+    reason = reason.mask((reason == "") & gender.isna(), "Gender غير معروف")
+
+    ok = reason == ""
+    clean = pd.DataFrame({
+        "FirstName": first[ok],
+        "LastName": last[ok],
+        "Age": age[ok].astype("int64"),
+        "Gender": gender[ok],
+        "Contact": contact[ok].where(contact[ok] != "", None),
+    })
+    rejected = df[~ok].copy()
+    rejected["RejectReason"] = reason[~ok]
+    return clean, rejected
+
+
+# ------------------ الاستيراد ------------------
+
+def default_reject_path(file_path):
+    return os.path.splitext(file_path)[0] + ".rejects.csv"
+
+
+def import_patients(db_file, file_path, progress=None, reject_path=None, chunk_size=CHUNK_SIZE):
+    reject_path = reject_path or default_reject_path(file_path)
+    imported = rejected = 0
+    reject_file = reject_writer = None
+    empty_photos = json.dumps([])
+
+    try:
+        for chunk in iter_chunks(file_path, chunk_size):
+            missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+            if missing:
+                raise ImportFormatError(f"أعمدة ناقصة: {', '.join(missing)}")
+
+            clean, bad = validate_chunk(chunk)
+            clean["ContactNorm"] = clean["Contact"].map(normalizeContact, na_action="ignore")
+            rows = [(*row, empty_photos) for row in
+                    clean[IMPORT_COLUMNS + ["ContactNorm"]].itertuples(index=False, name=None)]
+            # كل دفعة في معاملة واحدة
+            with dbSession(db_file) as (conn, cursor):
+                cursor.executemany("""
+                    INSERT INTO patients (FirstName, LastName, Age, Gender, Contact, ContactNorm, Photos)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+            imported += len(rows)
+
+            if len(bad):
+                if reject_writer is None:
+                    reject_file = open(reject_path, "w", newline="", encoding="utf-8-sig")
+                    reject_writer = csv.writer(reject_file)
+                    reject_writer.writerow(list(bad.columns))
+                reject_writer.writerows(bad.itertuples(index=False, name=None))
+                rejected += len(bad)
+
+            if progress:
+                progress(imported + rejected, imported, rejected)
+    finally:
+        if reject_file is not None:
+            reject_file.close()
+
+    return {
+        "imported": imported,
+        "rejected": rejected,
+        "reject_file": reject_path if rejected else None,
+    }
+
+
+# ------------------ التصدير ------------------
+
+# أعمدة تحسبها القاعدة من غيرها (رقم التواصل القياسي)؛ لا تُصدَّر إلا إذا طُلبت صراحة
+DERIVED_COLUMNS = ("ContactNorm",)
+
+
+def patient_columns(cursor):
+    cursor.execute("PRAGMA table_info(patients)")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _export_query(all_columns, columns, date_from, date_to, include_deleted):
+    columns = list(columns or [c for c in all_columns if c not in DERIVED_COLUMNS])
+    unknown = [c for c in columns if c not in all_columns]
+    if unknown:
+        raise ValueError(f"أعمدة غير موجودة: {', '.join(unknown)}")
+
+    query = "SELECT " + ", ".join(f'"{c}"' for c in columns) + " FROM patients WHERE 1 = 1"
+    params = []
+    if not include_deleted:
+        query += " AND Deleted = 0"
+    if date_from:
+        query += " AND DateAdded >= ?"
+        params.append(str(date_from))
+    if date_to:
+        # تاريخ النهاية شامل لليوم كله
+        query += " AND DateAdded < date(?, '+1 day')"
+        params.append(str(date_to))
+    query += " ORDER BY ID DESC"
+    return columns, query, params
+
+
+class _XlsxSink:
+    def __init__(self, file_path, columns):
+        from openpyxl import Workbook
+
+        # write_only يكتب الصفوف مباشرة إلى ملف مؤقت بدل الاحتفاظ بها في الذاكرة
+        self.file_path = file_path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("patients")
+        self.sheet.append(columns)
+
+    def write(self, rows):
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.file_path)
+
+
+class _CsvSink:
+    def __init__(self, file_path, columns):
+        self.file = open(file_path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetSink:
+    def __init__(self, file_path, columns):
+        import pyarrow  # اختياري: مطلوب فقط لتصدير Parquet
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.columns = columns
+        self.file_path = file_path
+        self.writer = None
+
+    def write(self, rows):
+        # كل دفعة تُكتب كـ row group مستقلة
+        table = self.pa.Table.from_pylist([dict(zip(self.columns, row)) for row in rows])
+        if self.writer is None:
+            self.writer = self.pa.parquet.ParquetWriter(self.file_path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is None:
+            empty = self.pa.table({c: self.pa.array([], self.pa.string()) for c in self.columns})
+            self.pa.parquet.write_table(empty, self.file_path)
+        else:
+            self.writer.close()
+
+
+EXPORT_SINKS = {".xlsx": _XlsxSink, ".csv": _CsvSink, ".parquet": _ParquetSink}
+# حزم اختيارية لبعض الصيغ؛ الصيغة لا تُعرض إذا لم تكن حزمتها مثبتة
+EXPORT_DEPENDENCIES = {".xlsx": "openpyxl", ".parquet": "pyarrow"}
+
+
+def export_formats():
+    """Export extensions usable in this environment, in EXPORT_SINKS order."""
+    return [extension for extension in EXPORT_SINKS
+            if extension not in EXPORT_DEPENDENCIES
+            or importlib.util.find_spec(EXPORT_DEPENDENCIES[extension]) is not None]
+
+
+def export_patients(db_file, file_path, columns=None, date_from=None, date_to=None,
+                    include_deleted=False, progress=None, chunk_size=CHUNK_SIZE):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in EXPORT_SINKS:
+        raise ValueError(f"صيغة تصدير غير مدعومة: {extension}")
+    if extension not in export_formats():
+        raise DataError(f"التصدير بصيغة {extension} يحتاج الحزمة {EXPORT_DEPENDENCIES[extension]}، وهي غير مثبتة",
+                        "export_data")
+
+    exported = 0
+    with dbSession(db_file, readonly=True) as (conn, cursor):
+        columns, query, params = _export_query(
+            patient_columns(cursor), columns, date_from, date_to, include_deleted)
+        sink = EXPORT_SINKS[extension](file_path, columns)
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                sink.write(rows)
+                exported += len(rows)
+                if progress:
+                    progress(exported)
+        finally:
+            sink.close()
+    return exported
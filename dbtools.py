@@ -0,0 +1,90 @@
+import argparse
+import sys
+
+from HospitalClass1 import Hospital
+from AppointmentClass import Appointment
+from migrations import migrate, check_query_plans
+
+
+# أدوات صيانة قواعد البيانات من سطر الأوامر
+def rebuild_search(args):
+    for db_file in args.db_files:
+        hospital = Hospital(db_file)
+        if hospital.rebuild_search_index():
+            print(f"{db_file}: تمت إعادة بناء فهرس البحث")
+        else:
+            print(f"{db_file}: FTS5 غير متوفر في نسخة SQLite الحالية")
+
+
+def rebuild_counters(args):
+    for db_file in args.db_files:
+        hospital = Hospital(db_file)
+        hospital.rebuild_stats()
+        print(f"{db_file}: {hospital.get_stats()}")
+
+
+def migrate_photos(args):
+    for db_file in args.db_files:
+        count = Hospital(db_file).import_legacy_photos()
+        print(f"{db_file}: تم نقل {count} صورة إلى المخزن")
+
+
+def backfill_dates(args):
+    for db_file in args.db_files:
+        count = Appointment(db_file).backfill_dates()
+        print(f"{db_file}: تم تحويل تواريخ {count} موعد إلى الصيغة القياسية")
+
+
+def run_migrations(args):
+    for db_file in args.db_files:
+        print(f"{db_file}: إصدار المخطط {migrate(db_file)}")
+
+
+def explain(args):
+    # يفشل الأمر إذا كان أي استعلام ساخن لا يستخدم فهرساً
+    all_ok = True
+    for db_file in args.db_files:
+        migrate(db_file)
+        for result in check_query_plans(db_file):
+            status = "OK  " if result["ok"] else "FAIL"
+            print(f"{status} {db_file}: {result['name']}")
+            for line in result["plan"]:
+                print(f"       {line}")
+            all_ok = all_ok and result["ok"]
+    return 0 if all_ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintenance commands for the clinic databases")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("rebuild-search", help="rebuild the patients full-text index")
+    cmd.add_argument("db_files", nargs="+")
+    cmd.set_defaults(func=rebuild_search)
+
+    cmd = commands.add_parser("rebuild-stats", help="recount the trigger-maintained counters")
+    cmd.add_argument("db_files", nargs="+")
+    cmd.set_defaults(func=rebuild_counters)
+
+    cmd = commands.add_parser("migrate-photos", help="move legacy Photos paths into the photo store")
+    cmd.add_argument("db_files", nargs="+")
+    cmd.set_defaults(func=migrate_photos)
+
+    cmd = commands.add_parser("backfill-dates", help="fill the canonical appointment date columns")
+    cmd.add_argument("db_files", nargs="+")
+    cmd.set_defaults(func=backfill_dates)
+
+    cmd = commands.add_parser("migrate", help="upgrade the schema to the latest version")
+    cmd.add_argument("db_files", nargs="+")
+    cmd.set_defaults(func=run_migrations)
+
+    cmd = commands.add_parser("explain", help="check that the hot queries use an index")
+    cmd.add_argument("db_files", nargs="+")
+    cmd.set_defaults(func=explain)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,27 @@
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
 from tkcalendar import DateEntry
 from AppointmentClass import Appointment 
 from HospitalClass1 import Hospital
+from async_db import AsyncFacade
+from utils import DataError
+
+# فحص المتابعات في الخلفية: عدّان على فهرس طابور المتابعة، كل بضع دقائق من ساعة الشاشة
+FOLLOWUP_SCAN_SECONDS = 300
+OVERDUE_LIST_LIMIT = 500
 
 class AppointmentApp(tk.Frame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
-        self.appointment_handler = Appointment("patients.db")
-        self.hospital_handler = Hospital("patients.db")
+        # فتح القاعدة وكل الاستعلامات تتم في خيط خلفي عبر self.db
+        self.appointment_handler = None
+        self.hospital_handler = None
+        self.db = AsyncFacade(None, self, on_error=self.show_data_error)
+        self.followup_scan_due = 0.0
+        self.followup_scanning = False
         self.current_patient_id = None
         style = ttk.Style(self)
         style.theme_use('vista')
@@ -19,12 +30,26 @@ class AppointmentApp(tk.Frame):
         style.configure("TEntry", font=("Arial", 11))
         style.configure("TLabelframe.Label", font=("Arial", 12, "bold"))
         self.configure(bg="#e0e0e0")
-        self.appointment_id = self.appointment_handler.count() + 1
+        self.appointment_id = ""
         self.entry_widgets = {}
 
         self.create_top_bar()
         self.create_main_content()
         self.update_time()
+        # فتح القاعدة وترحيلها يبدأ بعد أول رسم للشاشة
+        self.after_idle(lambda: self.db.run(self.open_handlers, "patients.db", on_success=self.handlers_ready))
+
+    @staticmethod
+    def open_handlers(db_file):
+        return Hospital(db_file), Appointment(db_file)
+
+    def handlers_ready(self, handlers):
+        self.hospital_handler, self.appointment_handler = handlers
+        self.refresh_counters()
+        self.scan_followups(force=True)
+
+    def show_data_error(self, error):
+        messagebox.showerror("خطأ", getattr(error, "message", None) or str(error))
 
     def create_top_bar(self):
         top_bar = tk.Frame(self, bg="#c5d6e2", height=40)
@@ -36,6 +61,101 @@ class AppointmentApp(tk.Frame):
         title_label.pack(side="right", padx=20, pady=5)
         settings_button = ttk.Button(top_bar, text="الإعدادات")
         settings_button.pack(side="right", padx=5)
+        ttk.Button(top_bar, text="مواعيد اليوم", command=self.show_day_schedule).pack(side="right", padx=5)
+        self.followups_button = ttk.Button(top_bar, text="المتابعات", command=self.show_followups)
+        self.followups_button.pack(side="right", padx=5)
+        self.counters_label = tk.Label(top_bar, font=("Arial", 11), bg=top_bar['bg'])
+        self.counters_label.pack(side="right", padx=20, pady=5)
+
+    def refresh_counters(self):
+        # قراءات O(1) من جداول العدادات
+        hospital, appointments = self.hospital_handler, self.appointment_handler
+        self.db.run(lambda: (hospital.get_stats(), appointments.count_for_day(), appointments.count()),
+                    operation="refresh_counters", on_success=self.show_counters)
+
+    def show_counters(self, result):
+        stats, today, total = result
+        self.appointment_id = total + 1
+        self.appointment_id_var.set(str(self.appointment_id))
+        self.counters_label.config(
+            text=f"مواعيد اليوم: {today}   المرضى: {stats['live_patients']}   كل المواعيد: {stats['appointments']}")
+
+    def show_day_schedule(self):
+        if self.appointment_handler is None:
+            messagebox.showerror("خطأ", "جاري فتح قاعدة البيانات، حاول بعد لحظات.")
+            return
+        self.db.run(self.appointment_handler.get_day_schedule, operation="get_day_schedule",
+                    on_success=self.open_schedule_window)
+
+    def open_schedule_window(self, entries):
+        window = tk.Toplevel(self)
+        window.title(f"مواعيد اليوم ({len(entries)})")
+        window.geometry("700x400")
+        columns = ("Time", "Name", "Contact", "Condition")
+        tree = ttk.Treeview(window, columns=columns, show="headings")
+        for column, title, width in zip(columns, ("الوقت", "المريض", "الهاتف", "الحالة"), (70, 220, 130, 250)):
+            tree.heading(column, text=title)
+            tree.column(column, width=width, anchor="center")
+        scrollbar = ttk.Scrollbar(window, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        tree.pack(fill="both", expand=True)
+        for entry in entries:
+            tree.insert("", "end", values=(entry.time or "—", f"{entry.FirstName} {entry.LastName}",
+                                           entry.Contact or "", entry.Condition or ""))
+
+    def scan_followups(self, force=False):
+        # يُستدعى كل ثانية من update_time، ولا يعمل إلا عند حلول موعد الفحص وعدم وجود فحص جارٍ
+        if self.appointment_handler is None or self.followup_scanning:
+            return
+        if not force and time.monotonic() < self.followup_scan_due:
+            return
+        self.followup_scanning = True
+        self.db.run(self.appointment_handler.followup_counts, operation="followup_counts",
+                    on_success=self.show_followup_counts, on_error=self.followup_scan_failed)
+
+    def show_followup_counts(self, counts):
+        self.followup_scanning = False
+        self.followup_scan_due = time.monotonic() + FOLLOWUP_SCAN_SECONDS
+        self.followups_button.config(
+            text=f"المتابعات: اليوم {counts['due_today']}   متأخرة {counts['overdue']}")
+
+    def followup_scan_failed(self, error):
+        # فحص خلفي: لا نافذة خطأ كل بضع دقائق، المحاولة التالية في موعدها
+        self.followup_scanning = False
+        self.followup_scan_due = time.monotonic() + FOLLOWUP_SCAN_SECONDS
+        self.followups_button.config(text="المتابعات: ؟")
+
+    def show_followups(self):
+        if self.appointment_handler is None:
+            messagebox.showerror("خطأ", "جاري فتح قاعدة البيانات، حاول بعد لحظات.")
+            return
+        appointments = self.appointment_handler
+        self.db.run(lambda: (appointments.get_due_followups(),
+                             appointments.get_overdue_followups(limit=OVERDUE_LIST_LIMIT)),
+                    operation="show_followups", on_success=self.open_followups_window)
+
+    def open_followups_window(self, result):
+        due, overdue = result
+        window = tk.Toplevel(self)
+        window.title(f"المتابعات: اليوم {len(due)}، متأخرة {len(overdue)}")
+        window.geometry("760x400")
+        columns = ("Due", "Name", "Contact", "LastVisit", "State")
+        tree = ttk.Treeview(window, columns=columns, show="headings")
+        titles = ("موعد المتابعة", "المريض", "الهاتف", "آخر زيارة", "الحالة")
+        for column, title, width in zip(columns, titles, (130, 220, 130, 130, 90)):
+            tree.heading(column, text=title)
+            tree.column(column, width=width, anchor="center")
+        tree.tag_configure("overdue", foreground="#b00020")
+        scrollbar = ttk.Scrollbar(window, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        tree.pack(fill="both", expand=True)
+        for followups, state, tags in ((due, "اليوم", ()), (overdue, "متأخرة", ("overdue",))):
+            for followup in followups:
+                tree.insert("", "end", values=(followup.DueISO, f"{followup.FirstName} {followup.LastName}",
+                                               followup.Contact or "", followup.LastVisitISO or "", state),
+                            tags=tags)
 
     def create_main_content(self):
         main_frame = tk.Frame(self, bg=self['bg'])
@@ -75,6 +195,7 @@ class AppointmentApp(tk.Frame):
         day_str_ar = arabic_day.get(day_str, day_str)
         full_str = f"{day_str_ar} {date_str}   الوقت: {time_str}"
         self.time_label.config(text=full_str)
+        self.scan_followups()
         self.after(1000, self.update_time)
 
     def save_appointment(self):
@@ -87,33 +208,49 @@ class AppointmentApp(tk.Frame):
             else:
                 appointment_data[name] = widget.get().strip()
 
-        # إذا لم يكن current_patient_id موجودًا، ابحث باستخدام رقم الهاتف أو اللقب
+        if self.appointment_handler is None:
+            messagebox.showerror("خطأ", "جاري فتح قاعدة البيانات، حاول بعد لحظات.")
+            return
+
         contact = appointment_data.get("رقم الهاتف", "")
         last_name = appointment_data.get("لقب المريض", "")
-        patient = self.hospital_handler.find_patient_by_contact_or_lastname(contact , last_name)
-        if  patient.empty:
-            messagebox.showerror("خطأ", "لم يتم العثور على المريض. الرجاء التحقق من المعلومات.")
-            return
-        self.current_patient_id = patient["ID"]    
 
         # ربط البيانات بالأعمدة في جدول المواعيد
+        # التاريخ والوقت يُحفظان معاً، والصيغة القياسية تُستخرج منهما في Appointment
+        appointment_date = " ".join(filter(None, (appointment_data.get("تاريخ الموعد", ""),
+                                                  appointment_data.get("الوقت", ""))))
+        # DateEntry لا يكون فارغاً أبداً (اليوم افتراضياً)؛ تاريخ لا يلي يوم الموعد يعني أنه لا متابعة
+        next_appointment = appointment_data.get("تاريخ الموعد القادم", "")
+        if not next_appointment or next_appointment <= appointment_data.get("تاريخ الموعد", ""):
+            next_appointment = None
         mapped_data = {
-            "AppointmentDate": appointment_data.get("تاريخ الموعد", ""),
+            "AppointmentDate": appointment_date,
             "Condition": appointment_data.get("ملاحظات", ""),
             "Treatment": appointment_data.get("العلاج", ""),
             "Symptoms": appointment_data.get("الأعراض", ""),
             "Notes": appointment_data.get("ملاحظات", ""),
-            "NextAppointment": appointment_data.get("تاريخ الموعد القادم", ""),
+            "NextAppointment": next_appointment,
             "Cost": appointment_data.get("المبلغ المدفوع", "0"),
             "CostRested": appointment_data.get("المبلغ المتبقي", "0")
         }
 
-        # أضف الموعد
-        new_id = self.appointment_handler.add_appointment(self.current_patient_id, mapped_data)
+        hospital, appointments = self.hospital_handler, self.appointment_handler
+
+        def save():
+            # ابحث عن المريض باستخدام رقم الهاتف أو اللقب، ثم أضف الموعد
+            patient = hospital.find_patient_by_contact_or_lastname(contact, last_name)
+            if patient is None:
+                raise DataError("لم يتم العثور على المريض. الرجاء التحقق من المعلومات.")
+            return patient["ID"], appointments.add_appointment(patient["ID"], mapped_data)
+
+        self.db.run(save, operation="save_appointment", on_success=self.appointment_saved)
+
+    def appointment_saved(self, result):
+        self.current_patient_id, new_id = result
         if new_id:
             messagebox.showinfo("تم", "تم حفظ الموعد بنجاح.")
-            self.appointment_id += 1
-            self.appointment_id_var.set(str(self.appointment_id))
+            self.refresh_counters()
+            self.scan_followups(force=True)
             self.clear_fields()
 
 
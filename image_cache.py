@@ -0,0 +1,193 @@
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageTk
+
+# ذاكرتان للمعاينات:
+#   1) في الذاكرة: PhotoImage جاهزة للعرض، بحد أقصى للبايتات (LRU)
+#   2) على القرص: صور مصغّرة محفوظة، مفتاحها بصمة الملف وتاريخ تعديله
+# فك الترميز يتم في خيط خلفي، وإنشاء PhotoImage يبقى في خيط Tk.
+
+PREVIEW_SIZE = (550, 550)
+MEMORY_BUDGET = 64 * 1024 * 1024
+POLL_MS = 30
+
+
+def cache_key(path, size):
+    stat = os.stat(path)
+    # ملفات المخزن مسمّاة ببصمة محتواها أصلاً؛ غيرها يُعرّف بمساره
+    identity = os.path.splitext(os.path.basename(path))[0]
+    if len(identity) != 64:
+        identity = os.path.abspath(path)
+    raw = f"{identity}|{stat.st_mtime_ns}|{stat.st_size}|{size[0]}x{size[1]}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def decode_preview(path, size):
+    image = Image.open(path)
+    # JPEG: draft يطلب من المفكك تصغيراً بمعامل 1/2..1/8 أثناء القراءة، أسرع بكثير من فك الصورة كاملة
+    if image.format == "JPEG":
+        image.draft("RGB", size)
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    return image
+
+
+class DiskPreviewCache:
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key + ".png")
+
+    def load(self, key):
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with Image.open(path) as image:
+                image.load()
+                return image
+        except OSError:
+            return None
+
+    def remove(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def store(self, key, image):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                image.save(out, format="PNG")
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class ImageCache:
+    def __init__(self, widget, memory_budget=MEMORY_BUDGET, workers=2):
+        self.widget = widget
+        self.memory_budget = memory_budget
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+        self._results = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._polling = False
+        # العدادات تُحدَّث من خيط Tk ومن خيوط الفك معاً، فكلها تحت self._lock
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    # ------------------ الذاكرة ------------------
+
+    def _remember(self, key, photo):
+        cost = photo.width() * photo.height() * 4
+        self._memory[key] = (photo, cost)
+        self._memory_bytes += cost
+        evicted = 0
+        while self._memory_bytes > self.memory_budget and len(self._memory) > 1:
+            _, (_, old_cost) = self._memory.popitem(last=False)
+            self._memory_bytes -= old_cost
+            evicted += 1
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def clear(self):
+        self._memory.clear()
+        self._memory_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "bytes": self._memory_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    # ------------------ الطلبات ------------------
+
+    def request(self, path, callback, size=PREVIEW_SIZE, disk_root=None):
+        """Call callback(photo, error) on the Tk thread, immediately on a memory hit."""
+        try:
+            key = cache_key(path, size)
+        except OSError as e:
+            callback(None, e)
+            return
+        cached = self._memory.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            self._memory.move_to_end(key)
+            callback(cached[0], None)
+            return
+
+        with self._lock:
+            if key in self._pending:
+                self._pending[key].append(callback)
+                return
+            self._pending[key] = [callback]
+        disk = DiskPreviewCache(disk_root) if disk_root else None
+        self._executor.submit(self._load, key, path, size, disk)
+        self._start_polling()
+
+    def _load(self, key, path, size, disk):
+        # يعمل في خيط خلفي: لا يلمس Tk إطلاقاً
+        try:
+            image = disk.load(key) if disk else None
+            with self._lock:
+                if image is not None:
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+            if image is None:
+                image = decode_preview(path, size)
+                if disk:
+                    disk.store(key, image)
+            self._results.put((key, image, None))
+        except Exception as e:
+            self._results.put((key, None, e))
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.widget.after(POLL_MS, self._poll)
+
+    def _poll(self):
+        while True:
+            try:
+                key, image, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            photo = None
+            if image is not None:
+                photo = ImageTk.PhotoImage(image)
+                self._remember(key, photo)
+            with self._lock:
+                callbacks = self._pending.pop(key, [])
+            for callback in callbacks:
+                callback(photo, error)
+        with self._lock:
+            busy = bool(self._pending)
+        if busy:
+            self.widget.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
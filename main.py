@@ -1,6 +1,18 @@
+import importlib
+import sys
+import time
 import tkinter as tk
-from HospitalGui import HospitalGUI
-from home1 import AppointmentApp
+from utils import closeAllDbs
+import async_db
+from query_stats import enable_slow_log
+
+STARTED = time.perf_counter()
+
+# الواجهات تُستورد وتُبنى عند أول عرض لها فقط؛ HospitalGUI تجرّ معها PIL ومعالجة الصور
+FRAMES = {
+    "AppointmentApp": "home1",
+    "HospitalGUI": "HospitalGui",
+}
 
 # التطبيق الأساسي
 class App(tk.Tk):
@@ -9,28 +21,52 @@ class App(tk.Tk):
         self.geometry("1024x768")
         self.title("الرئيسية")
         # هذا الإطار يحتوي على كل الواجهات
-        container = tk.Frame(self)
-        container.pack(fill="both", expand=True)
+        self.container = tk.Frame(self)
+        self.container.pack(fill="both", expand=True)
         self.frames = {}
+        # زمن أول رسم للشاشة منذ بدء تحميل main، بالمللي ثانية
+        self.first_paint_ms = None
+
+        self.show_frame("AppointmentApp")
+        self.after_idle(self.first_painted)
+
+    def first_painted(self):
+        self.first_paint_ms = (time.perf_counter() - STARTED) * 1000
 
-        # إنشاء الواجهات وإضافتها
-        for F in (HospitalGUI, AppointmentApp):
-            page_name = F.__name__
-            frame = F(container, self)
+    def get_frame(self, page_name):
+        frame = self.frames.get(page_name)
+        if frame is None:
+            frame_class = getattr(importlib.import_module(FRAMES[page_name]), page_name)
+            frame = frame_class(self.container, self)
             self.frames[page_name] = frame
             frame.grid(row=0, column=0, sticky="nsew")
-
-        self.show_frame("AppointmentApp")  
+        return frame
 
     def show_frame(self, page_name):
         if page_name == "HospitalGUI":
             self.title("نظام إدارة المستشفى")
         else:
             self.title("الرئيسية")
-        frame = self.frames[page_name]
+        frame = self.get_frame(page_name)
         frame.tkraise()
 
 
+def shutdown(app=None):
+    # كل واجهة بُنيت توقف خيوطها الخاصة (البحث، المعاينات)
+    for frame in (app.frames.values() if app is not None else ()):
+        if hasattr(frame, "shutdown"):
+            frame.shutdown()
+    # مجمع عمليات الصور لا يوجد إلا إذا فُتحت واجهة المرضى
+    photo_ingest = sys.modules.get("photo_ingest")
+    if photo_ingest is not None:
+        photo_ingest.shutdown_executor()
+    async_db.shutdown_executor()
+    closeAllDbs()
+
+
 if __name__ == "__main__":
+    # الجمل الأبطأ من SLOW_QUERY_MS تُسجّل في slow_queries.log بجانب القاعدة
+    enable_slow_log(db_file="patients.db")
     app = App()
     app.mainloop()
+    shutdown(app)
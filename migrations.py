@@ -0,0 +1,576 @@
+import sqlite3
+from utils import dbSession, normalizeContact, canonicalDateTime
+from records import PATIENT_COLUMNS
+
+# ترحيل مخطط قاعدة البيانات بالإصدارات؛ الإصدار الحالي محفوظ في PRAGMA user_version.
+# كل ترحيل قائمة من جمل SQL أو دوال تستقبل cursor، ويُنفّذ في معاملة واحدة.
+# لا تعدّل ترحيلاً منشوراً: أضف ترحيلاً جديداً في آخر القائمة.
+
+PATIENTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS patients (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        FirstName TEXT NOT NULL,
+        LastName TEXT NOT NULL,
+        Age INTEGER NOT NULL,
+        Gender TEXT NOT NULL,
+        Contact TEXT,
+        Photos TEXT,
+        DateAdded TEXT DEFAULT CURRENT_TIMESTAMP,
+        LastModified TEXT DEFAULT CURRENT_TIMESTAMP,
+        Deleted INTEGER DEFAULT 0
+    )
+'''
+
+APPOINTMENTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS appointments (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientID INTEGER NOT NULL,
+        AppointmentDate TEXT NOT NULL,
+        Condition TEXT,
+        Treatment TEXT,
+        Symptoms TEXT,
+        Notes TEXT,
+        NextAppointment TEXT,
+        DateAdded TEXT DEFAULT CURRENT_TIMESTAMP,
+        LastModified TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (PatientID) REFERENCES patients(ID) ON DELETE CASCADE
+    )
+'''
+
+# فهرس البحث النصي: نسخة ظل من الأسماء ورقم التواصل للمرضى غير المحذوفين فقط.
+# الترحيل 2 فهرس Contact كما كُتب؛ الترحيل 10 يستبدله بـ ContactNorm، ليجد البحث الرقم بأي صيغة كُتب بها
+SEARCH_INDEX_TRIGGERS = ("patients_fts_ai", "patients_fts_au", "patients_fts_ad")
+
+
+def search_index_sql(contact="ContactNorm"):
+    return (
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+            FirstName, LastName, {contact},
+            content='patients', content_rowid='ID', tokenize='trigram'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients
+        WHEN new.Deleted = 0
+        BEGIN
+            INSERT INTO patients_fts (rowid, FirstName, LastName, {contact})
+            VALUES (new.ID, new.FirstName, new.LastName, new.{contact});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, FirstName, LastName, {contact})
+            SELECT 'delete', old.ID, old.FirstName, old.LastName, old.{contact} WHERE old.Deleted = 0;
+            INSERT INTO patients_fts (rowid, FirstName, LastName, {contact})
+            SELECT new.ID, new.FirstName, new.LastName, new.{contact} WHERE new.Deleted = 0;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients
+        WHEN old.Deleted = 0
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, FirstName, LastName, {contact})
+            VALUES ('delete', old.ID, old.FirstName, old.LastName, old.{contact});
+        END
+        """,
+    )
+
+
+def fill_search_index(cursor, contact="ContactNorm"):
+    cursor.execute("INSERT INTO patients_fts (patients_fts) VALUES ('delete-all')")
+    cursor.execute(f"""
+        INSERT INTO patients_fts (rowid, FirstName, LastName, {contact})
+        SELECT ID, FirstName, LastName, {contact} FROM patients WHERE Deleted = 0
+    """)
+
+
+def has_table(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def create_search_index(cursor, contact="ContactNorm"):
+    # نسخ SQLite بدون FTS5/trigram تتخطى هذا الترحيل ويبقى البحث بـ LIKE؛
+    # ensure_search_index يعيد المحاولة عند كل فتح، فيُبنى الفهرس بعد ترقية SQLite
+    try:
+        cursor.execute("SAVEPOINT search_index")
+        for statement in search_index_sql(contact):
+            cursor.execute(statement)
+        fill_search_index(cursor, contact)
+        cursor.execute("RELEASE search_index")
+        return True
+    except sqlite3.OperationalError:
+        cursor.execute("ROLLBACK TO search_index")
+        cursor.execute("RELEASE search_index")
+        return False
+
+
+def ensure_search_index(conn, cursor):
+    """Create patients_fts if its migration was recorded without it; True when it was created now."""
+    if get_version(cursor) < SEARCH_INDEX_VERSION or has_table(cursor, "patients_fts"):
+        return False
+    conn.commit()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        created = not has_table(cursor, "patients_fts") and create_search_index(cursor)
+        conn.commit()
+        return created
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def create_search_index_v1(cursor):
+    return create_search_index(cursor, contact="Contact")
+
+
+def replace_search_index(cursor):
+    # الفهرس الخارجي لا يُعدَّل عموده، فيُحذف ويُبنى من جديد على ContactNorm
+    for trigger in SEARCH_INDEX_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS patients_fts")
+    create_search_index(cursor)
+
+
+def has_column(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def add_contact_norm(cursor):
+    # رقم التواصل بالشكل القياسي، ليصبح البحث بالمساواة عبر الفهرس
+    if not has_column(cursor, "patients", "ContactNorm"):
+        cursor.execute("ALTER TABLE patients ADD COLUMN ContactNorm TEXT")
+    cursor.execute("SELECT ID, Contact FROM patients WHERE Contact IS NOT NULL")
+    updates = [(normalizeContact(contact), patient_id) for patient_id, contact in cursor.fetchall()]
+    cursor.executemany("UPDATE patients SET ContactNorm = ? WHERE ID = ?", updates)
+
+
+# ------------------ العدادات ------------------
+# جداول صغيرة تحدّثها المشغّلات، فتصبح قراءة الإجماليات O(1) بدل COUNT(*)
+
+STATS_SQL = (
+    "CREATE TABLE IF NOT EXISTS stats (Name TEXT PRIMARY KEY, Value INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID",
+    """CREATE TABLE IF NOT EXISTS patient_appointment_counts (
+        PatientID INTEGER PRIMARY KEY, Total INTEGER NOT NULL DEFAULT 0)""",
+    """CREATE TABLE IF NOT EXISTS daily_appointment_counts (
+        Day TEXT PRIMARY KEY, Total INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID""",
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_patients_ai AFTER INSERT ON patients
+    BEGIN
+        UPDATE stats SET Value = Value + 1
+        WHERE Name = CASE WHEN new.Deleted IS 0 THEN 'live_patients' ELSE 'deleted_patients' END;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_patients_au AFTER UPDATE OF Deleted ON patients
+    WHEN (old.Deleted IS 0) != (new.Deleted IS 0)
+    BEGIN
+        UPDATE stats SET Value = Value + CASE WHEN new.Deleted IS 0 THEN 1 ELSE -1 END
+        WHERE Name = 'live_patients';
+        UPDATE stats SET Value = Value + CASE WHEN new.Deleted IS 0 THEN -1 ELSE 1 END
+        WHERE Name = 'deleted_patients';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_patients_ad AFTER DELETE ON patients
+    BEGIN
+        UPDATE stats SET Value = Value - 1
+        WHERE Name = CASE WHEN old.Deleted IS 0 THEN 'live_patients' ELSE 'deleted_patients' END;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_appointments_ai AFTER INSERT ON appointments
+    BEGIN
+        UPDATE stats SET Value = Value + 1 WHERE Name = 'appointments';
+        INSERT INTO patient_appointment_counts (PatientID, Total) VALUES (new.PatientID, 1)
+            ON CONFLICT (PatientID) DO UPDATE SET Total = Total + 1;
+        INSERT INTO daily_appointment_counts (Day, Total) VALUES (substr(new.AppointmentDate, 1, 10), 1)
+            ON CONFLICT (Day) DO UPDATE SET Total = Total + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_appointments_au AFTER UPDATE OF PatientID, AppointmentDate ON appointments
+    BEGIN
+        UPDATE patient_appointment_counts SET Total = Total - 1 WHERE PatientID = old.PatientID;
+        INSERT INTO patient_appointment_counts (PatientID, Total) VALUES (new.PatientID, 1)
+            ON CONFLICT (PatientID) DO UPDATE SET Total = Total + 1;
+        UPDATE daily_appointment_counts SET Total = Total - 1 WHERE Day = substr(old.AppointmentDate, 1, 10);
+        INSERT INTO daily_appointment_counts (Day, Total) VALUES (substr(new.AppointmentDate, 1, 10), 1)
+            ON CONFLICT (Day) DO UPDATE SET Total = Total + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_appointments_ad AFTER DELETE ON appointments
+    BEGIN
+        UPDATE stats SET Value = Value - 1 WHERE Name = 'appointments';
+        UPDATE patient_appointment_counts SET Total = Total - 1 WHERE PatientID = old.PatientID;
+        UPDATE daily_appointment_counts SET Total = Total - 1 WHERE Day = substr(old.AppointmentDate, 1, 10);
+    END
+    """,
+)
+
+
+def repair_blob_patient_ids(cursor):
+    # إصدارات سابقة مرّرت numpy.int64 فخُزّن PatientID كـ BLOB من 8 بايت
+    cursor.execute("SELECT ID, PatientID FROM appointments WHERE typeof(PatientID) = 'blob'")
+    repaired = [(int.from_bytes(blob, "little", signed=True), appointment_id)
+                for appointment_id, blob in cursor.fetchall() if len(blob) == 8]
+    cursor.executemany("UPDATE appointments SET PatientID = ? WHERE ID = ?", repaired)
+
+
+def rebuild_stats(cursor):
+    # يعيد حساب العدادات من الجداول الأصلية (بعد الترحيل أو لإصلاح أي انحراف)
+    day = (APPOINTMENT_DAY_SQL.format(row="") if has_column(cursor, "appointments", "AppointmentISO")
+           else "substr(AppointmentDate, 1, 10)")
+    cursor.execute("DELETE FROM stats")
+    cursor.execute("""
+        INSERT INTO stats (Name, Value)
+        SELECT 'live_patients', COUNT(*) FROM patients WHERE Deleted = 0
+        UNION ALL SELECT 'deleted_patients', COUNT(*) FROM patients WHERE Deleted IS NOT 0
+        UNION ALL SELECT 'appointments', COUNT(*) FROM appointments
+    """)
+    cursor.execute("DELETE FROM patient_appointment_counts")
+    cursor.execute("""
+        INSERT INTO patient_appointment_counts (PatientID, Total)
+        SELECT PatientID, COUNT(*) FROM appointments GROUP BY PatientID
+    """)
+    cursor.execute("DELETE FROM daily_appointment_counts")
+    cursor.execute("""
+        INSERT INTO daily_appointment_counts (Day, Total)
+        SELECT {day}, COUNT(*) FROM appointments GROUP BY 1
+    """.format(day=day))
+
+
+# ------------------ التواريخ القياسية للمواعيد ------------------
+# AppointmentDate و NextAppointment نص حر بصيغ مختلفة؛ بجانبهما عمود ISO-8601 وعمود ثوانٍ مفهرس.
+# الكتابة من Appointment تملأ الأعمدة القياسية، و backfill_appointment_dates يملأ ما كُتب بأدوات أخرى.
+
+APPOINTMENT_DATE_COLUMNS = (
+    ("AppointmentISO", "TEXT"), ("AppointmentTs", "INTEGER"),
+    ("NextAppointmentISO", "TEXT"), ("NextAppointmentTs", "INTEGER"),
+)
+BACKFILL_BATCH = 10_000
+# اليوم القياسي، مع الرجوع إلى النص الأصلي إن لم يُقرأ التاريخ
+APPOINTMENT_DAY_SQL = "COALESCE(substr({row}AppointmentISO, 1, 10), substr({row}AppointmentDate, 1, 10))"
+
+
+def add_appointment_date_columns(cursor):
+    for column, column_type in APPOINTMENT_DATE_COLUMNS:
+        if not has_column(cursor, "appointments", column):
+            cursor.execute(f"ALTER TABLE appointments ADD COLUMN {column} {column_type}")
+
+
+def backfill_appointment_dates(cursor, batch=BACKFILL_BATCH):
+    """Parse the text dates of rows whose canonical columns are empty; returns how many rows were filled."""
+    filled = 0
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT ID, AppointmentDate, NextAppointment, AppointmentTs, NextAppointmentTs FROM appointments
+            WHERE ID > ? AND ((AppointmentTs IS NULL AND COALESCE(AppointmentDate, '') != '')
+                              OR (NextAppointmentTs IS NULL AND COALESCE(NextAppointment, '') != ''))
+            ORDER BY ID LIMIT ?
+        """, (last_id, batch))
+        rows = cursor.fetchall()
+        if not rows:
+            return filled
+        updates = []
+        for appointment_id, appointment_date, next_appointment, appointment_ts, next_ts in rows:
+            date_iso, date_ts = canonicalDateTime(appointment_date)
+            next_iso, new_next_ts = canonicalDateTime(next_appointment)
+            # نص لا يُقرأ يبقى NULL، ولا يُعاد كتابته في كل مرة
+            if (date_ts, new_next_ts) != (appointment_ts, next_ts):
+                updates.append((date_iso, date_ts, next_iso, new_next_ts, appointment_id))
+        cursor.executemany("""
+            UPDATE appointments
+            SET AppointmentISO = ?, AppointmentTs = ?, NextAppointmentISO = ?, NextAppointmentTs = ?
+            WHERE ID = ?
+        """, updates)
+        filled += len(updates)
+        last_id = rows[-1][0]
+
+
+CANONICAL_DAY_TRIGGERS_SQL = (
+    "DROP TRIGGER IF EXISTS stats_appointments_ai",
+    "DROP TRIGGER IF EXISTS stats_appointments_au",
+    "DROP TRIGGER IF EXISTS stats_appointments_ad",
+    f"""
+    CREATE TRIGGER stats_appointments_ai AFTER INSERT ON appointments
+    BEGIN
+        UPDATE stats SET Value = Value + 1 WHERE Name = 'appointments';
+        INSERT INTO patient_appointment_counts (PatientID, Total) VALUES (new.PatientID, 1)
+            ON CONFLICT (PatientID) DO UPDATE SET Total = Total + 1;
+        INSERT INTO daily_appointment_counts (Day, Total) VALUES ({APPOINTMENT_DAY_SQL.format(row="new.")}, 1)
+            ON CONFLICT (Day) DO UPDATE SET Total = Total + 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER stats_appointments_au
+    AFTER UPDATE OF PatientID, AppointmentDate, AppointmentISO ON appointments
+    BEGIN
+        UPDATE patient_appointment_counts SET Total = Total - 1 WHERE PatientID = old.PatientID;
+        INSERT INTO patient_appointment_counts (PatientID, Total) VALUES (new.PatientID, 1)
+            ON CONFLICT (PatientID) DO UPDATE SET Total = Total + 1;
+        UPDATE daily_appointment_counts SET Total = Total - 1 WHERE Day = {APPOINTMENT_DAY_SQL.format(row="old.")};
+        INSERT INTO daily_appointment_counts (Day, Total) VALUES ({APPOINTMENT_DAY_SQL.format(row="new.")}, 1)
+            ON CONFLICT (Day) DO UPDATE SET Total = Total + 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER stats_appointments_ad AFTER DELETE ON appointments
+    BEGIN
+        UPDATE stats SET Value = Value - 1 WHERE Name = 'appointments';
+        UPDATE patient_appointment_counts SET Total = Total - 1 WHERE PatientID = old.PatientID;
+        UPDATE daily_appointment_counts SET Total = Total - 1 WHERE Day = {APPOINTMENT_DAY_SQL.format(row="old.")};
+    END
+    """,
+)
+
+
+# ------------------ طابور المتابعة ------------------
+# لكل مريض سطر واحد: موعد المتابعة (NextAppointment) المطلوب في آخر زيارة له.
+# زيارة لاحقة تحلّ محله، فالمتأخر هو ما تجاوز موعده ولم تأتِ بعده زيارة.
+# المشغّلات تعيد حساب سطر المريض عند كل تغيير في مواعيده، عبر فهرس (PatientID, AppointmentTs).
+
+FOLLOWUPS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS followups (
+        PatientID INTEGER PRIMARY KEY,
+        AppointmentID INTEGER NOT NULL,
+        LastVisitISO TEXT,
+        DueISO TEXT,
+        DueTs INTEGER NOT NULL
+    )
+"""
+
+# موعد المتابعة يُعتبر فقط إذا وقع في يوم بعد يوم الزيارة (الثواني / 86400 = رقم اليوم)؛
+# الترحيل 9 كان يقبل أي تاريخ، فصار كل موعد بلا متابعة "مستحقاً اليوم" ثم متأخراً
+FOLLOWUP_DUE_V1 = "NextAppointmentTs IS NOT NULL"
+FOLLOWUP_DUE = "NextAppointmentTs IS NOT NULL AND NextAppointmentTs / 86400 > AppointmentTs / 86400"
+FOLLOWUP_TRIGGERS = ("followups_appointments_ai", "followups_appointments_au", "followups_appointments_ad")
+
+FOLLOWUP_REFRESH_SQL = """
+        DELETE FROM followups WHERE PatientID = {patient};
+        INSERT INTO followups (PatientID, AppointmentID, LastVisitISO, DueISO, DueTs)
+        SELECT PatientID, ID, AppointmentISO, NextAppointmentISO, NextAppointmentTs FROM (
+            SELECT PatientID, ID, AppointmentISO, AppointmentTs, NextAppointmentISO, NextAppointmentTs
+            FROM appointments
+            WHERE PatientID = {patient} AND AppointmentTs IS NOT NULL
+            ORDER BY AppointmentTs DESC, ID DESC LIMIT 1
+        ) WHERE {condition};
+"""
+
+
+def followup_triggers_sql(condition=FOLLOWUP_DUE):
+    refresh = lambda patient: FOLLOWUP_REFRESH_SQL.format(patient=patient, condition=condition)
+    return (
+        f"""
+        CREATE TRIGGER IF NOT EXISTS followups_appointments_ai AFTER INSERT ON appointments
+        BEGIN
+            {refresh("new.PatientID")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS followups_appointments_au
+        AFTER UPDATE OF PatientID, AppointmentTs, NextAppointmentTs ON appointments
+        BEGIN
+            {refresh("old.PatientID")}
+            {refresh("new.PatientID")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS followups_appointments_ad AFTER DELETE ON appointments
+        BEGIN
+            {refresh("old.PatientID")}
+        END
+        """,
+    )
+
+
+def rebuild_followups(cursor, condition=FOLLOWUP_DUE):
+    # يعيد بناء الطابور كله من آخر زيارة لكل مريض
+    cursor.execute("DELETE FROM followups")
+    cursor.execute(f"""
+        INSERT INTO followups (PatientID, AppointmentID, LastVisitISO, DueISO, DueTs)
+        SELECT PatientID, ID, AppointmentISO, NextAppointmentISO, NextAppointmentTs FROM (
+            SELECT PatientID, ID, AppointmentISO, AppointmentTs, NextAppointmentISO, NextAppointmentTs,
+                   ROW_NUMBER() OVER (PARTITION BY PatientID ORDER BY AppointmentTs DESC, ID DESC) AS Latest
+            FROM appointments WHERE AppointmentTs IS NOT NULL
+        ) WHERE Latest = 1 AND {condition}
+    """)
+
+
+def rebuild_followups_v1(cursor):
+    rebuild_followups(cursor, FOLLOWUP_DUE_V1)
+
+
+def replace_followup_triggers(cursor):
+    for trigger in FOLLOWUP_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for statement in followup_triggers_sql():
+        cursor.execute(statement)
+
+
+MIGRATIONS = [
+    (1, "base schema", [PATIENTS_TABLE_SQL, APPOINTMENTS_TABLE_SQL]),
+    (2, "patients full-text index", [create_search_index_v1]),
+    (3, "indexes for hot queries", [
+        "CREATE INDEX IF NOT EXISTS idx_patients_live ON patients(ID) WHERE Deleted = 0",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments(PatientID, AppointmentDate DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments(AppointmentDate)",
+    ]),
+    (4, "point lookups by contact and last name", [
+        add_contact_norm,
+        "CREATE INDEX IF NOT EXISTS idx_patients_contact_norm ON patients(ContactNorm) WHERE Deleted = 0",
+        "CREATE INDEX IF NOT EXISTS idx_patients_lastname ON patients(LastName) WHERE Deleted = 0",
+    ]),
+    (5, "trigger-maintained counters", [repair_blob_patient_ids, *STATS_SQL, rebuild_stats]),
+    (6, "managed photo store", [
+        """
+        CREATE TABLE IF NOT EXISTS photos (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            PatientID INTEGER NOT NULL,
+            Hash TEXT NOT NULL,
+            Extension TEXT NOT NULL DEFAULT '',
+            OriginalName TEXT,
+            Size INTEGER,
+            Width INTEGER,
+            Height INTEGER,
+            Created TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (PatientID, Hash),
+            FOREIGN KEY (PatientID) REFERENCES patients(ID) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_photos_hash ON photos(Hash)",
+    ]),
+    (7, "change tracking by LastModified", [
+        "UPDATE patients SET LastModified = COALESCE(DateAdded, CURRENT_TIMESTAMP) WHERE LastModified IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_patients_last_modified ON patients(LastModified)",
+    ]),
+    (8, "canonical appointment dates", [
+        add_appointment_date_columns,
+        # الملء قبل تغيير المشغّلات لا يحرّكها، ثم تُعاد العدادات مرة واحدة بالأيام القياسية
+        backfill_appointment_dates,
+        *CANONICAL_DAY_TRIGGERS_SQL,
+        "DROP INDEX IF EXISTS idx_appointments_patient_date",
+        "DROP INDEX IF EXISTS idx_appointments_date",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_patient_ts ON appointments(PatientID, AppointmentTs DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_ts ON appointments(AppointmentTs)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_next_ts ON appointments(NextAppointmentTs)"
+        " WHERE NextAppointmentTs IS NOT NULL",
+        rebuild_stats,
+    ]),
+    (9, "follow-up queue", [
+        FOLLOWUPS_TABLE_SQL,
+        "CREATE INDEX IF NOT EXISTS idx_followups_due ON followups(DueTs)",
+        *followup_triggers_sql(FOLLOWUP_DUE_V1),
+        rebuild_followups_v1,
+    ]),
+    (10, "search the normalized contact", [replace_search_index]),
+    (11, "photos by patient in upload order", [
+        "CREATE INDEX IF NOT EXISTS idx_photos_patient ON photos(PatientID, ID)",
+    ]),
+    (12, "follow-ups only after the visit day", [replace_followup_triggers, rebuild_followups]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+# أول إصدار يكون فيه الفهرس على ContactNorm؛ قبله يبنيه الترحيل نفسه
+SEARCH_INDEX_VERSION = 10
+
+
+def get_version(cursor):
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+
+def migrate(db_file, target=LATEST_VERSION):
+    with dbSession(db_file) as (conn, cursor):
+        if get_version(cursor) >= target:
+            ensure_search_index(conn, cursor)
+            return get_version(cursor)
+        for version, _name, steps in MIGRATIONS:
+            if version > target:
+                break
+            # BEGIN IMMEDIATE يمنع محطتين من تنفيذ نفس الترحيل معاً
+            conn.commit()
+            cursor.execute("BEGIN IMMEDIATE")
+            if get_version(cursor) >= version:
+                conn.rollback()
+                continue
+            try:
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        ensure_search_index(conn, cursor)
+        cursor.execute("PRAGMA optimize")
+        return get_version(cursor)
+
+
+# ------------------ فحص خطط الاستعلامات ------------------
+# الاستعلامات الساخنة مع معاملات نموذجية؛ كل واحد يجب أن يستخدم فهرساً ولا يحتاج فرزاً مؤقتاً
+
+HOT_QUERIES = [
+    ("get_all_patients",
+     f"SELECT {PATIENT_COLUMNS} FROM patients WHERE Deleted = 0 ORDER BY ID DESC", ()),
+    ("list_patients_page",
+     "SELECT * FROM patients WHERE Deleted = 0 AND ID < ? ORDER BY ID DESC LIMIT ?", (1, 50)),
+    ("get_total_patients",
+     "SELECT COUNT(*) FROM patients WHERE Deleted = 0", ()),
+    ("get_appointments_by_patient",
+     "SELECT * FROM appointments WHERE PatientID = ? ORDER BY AppointmentTs DESC", (1,)),
+    ("get_schedule",
+     "SELECT a.ID, p.FirstName, p.LastName FROM appointments a JOIN patients p ON p.ID = a.PatientID"
+     " WHERE a.AppointmentTs >= ? AND a.AppointmentTs < ? AND p.Deleted = 0 ORDER BY a.AppointmentTs, a.ID",
+     (1751328000, 1751414400)),
+    ("get_due_followups",
+     "SELECT f.PatientID, p.FirstName FROM followups f JOIN patients p ON p.ID = f.PatientID"
+     " WHERE f.DueTs >= ? AND f.DueTs < ? AND p.Deleted = 0 ORDER BY f.DueTs",
+     (1751328000, 1751414400)),
+    ("get_appointments_between",
+     "SELECT * FROM appointments WHERE AppointmentTs >= ? AND AppointmentTs < ? ORDER BY AppointmentTs",
+     (1751328000, 1751932800)),
+    ("find_patient_by_contact",
+     "SELECT * FROM patients WHERE ContactNorm = ? AND Deleted = 0 ORDER BY ID DESC LIMIT 1", ("0555",)),
+    ("find_patients_by_last_name",
+     "SELECT * FROM patients WHERE LastName = ? AND Deleted = 0 ORDER BY ID DESC LIMIT ?", ("x", 20)),
+    ("patient_appointment_count",
+     "SELECT Total FROM patient_appointment_counts WHERE PatientID = ?", (1,)),
+    ("get_patient_changes",
+     "SELECT ID FROM patients WHERE LastModified >= ? ORDER BY LastModified LIMIT ?",
+     ("2025-01-01 00:00:00", 1000)),
+    ("list_photos",
+     "SELECT * FROM photos WHERE PatientID = ? ORDER BY ID", (1,)),
+    ("get_all_appointments",
+     "SELECT * FROM appointments ORDER BY AppointmentTs DESC LIMIT ?", (100,)),
+]
+
+
+def plan_uses_index(plan_lines):
+    uses_index = False
+    for line in plan_lines:
+        if "TEMP B-TREE" in line:
+            return False
+        if "USING" in line or "VIRTUAL TABLE INDEX" in line:
+            uses_index = True
+        elif line.startswith("SCAN"):
+            return False
+    return uses_index
+
+
+def check_query_plans(db_file, queries=None):
+    results = []
+    with dbSession(db_file, readonly=True) as (conn, cursor):
+        for name, sql, params in (queries or HOT_QUERIES):
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[3] for row in cursor.fetchall()]
+            results.append({"name": name, "sql": sql, "plan": plan, "ok": plan_uses_index(plan)})
+    return results
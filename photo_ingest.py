@@ -0,0 +1,102 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from image_cache import PREVIEW_SIZE, DiskPreviewCache, cache_key, decode_preview
+from photo_store import PhotoStore
+
+# معالجة دفعات الصور في عمليات منفصلة: التحقق، تصحيح الاتجاه وحذف EXIF،
+# النسخ إلى المخزن وتوليد المعاينة مسبقاً. خيط Tk يتابع التقدم فقط.
+
+POLL_MS = 50
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) - 1))
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _normalized_bytes(image, source_format):
+    # إعادة الترميز فقط عند وجود EXIF، لتجنّب فقدان الجودة بلا داعٍ
+    image = ImageOps.exif_transpose(image)
+    out = io.BytesIO()
+    params = {"icc_profile": image.info.get("icc_profile")} if image.info.get("icc_profile") else {}
+    if source_format == "JPEG":
+        image.convert("RGB").save(out, format="JPEG", quality=95, **params)
+    else:
+        image.save(out, format=source_format or "PNG", **params)
+    return out.getvalue()
+
+
+def ingest_file(file_path, store_root, preview_root):
+    """Worker: validate one image, store it normalised and pre-render its preview."""
+    with Image.open(file_path) as probe:
+        probe.verify()
+    with Image.open(file_path) as image:
+        source_format = image.format
+        has_exif = bool(image.getexif())
+        data = _normalized_bytes(image, source_format) if has_exif else None
+
+    store = PhotoStore(root=store_root)
+    if data is None:
+        stored = store.put_file(file_path)
+    else:
+        extension = os.path.splitext(file_path)[1].lower()
+        stored = store.put_bytes(data, extension, os.path.basename(file_path))
+
+    if preview_root:
+        target = store.path_for(stored["Hash"], stored["Extension"])
+        DiskPreviewCache(preview_root).store(cache_key(target, PREVIEW_SIZE), decode_preview(target, PREVIEW_SIZE))
+    return stored
+
+
+class PhotoIngestJob:
+    """Runs ingest_file for many files in the process pool and reports back on the Tk thread."""
+
+    def __init__(self, widget, hospital, file_paths, on_progress=None, on_done=None):
+        self.widget = widget
+        self.file_paths = list(file_paths)
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.results = {}
+        self.errors = {}
+        store_root = hospital.photo_store.root
+        preview_root = hospital.photo_store.preview_root
+        executor = get_executor()
+        self._futures = {executor.submit(ingest_file, path, store_root, preview_root): path
+                         for path in self.file_paths}
+        self.widget.after(POLL_MS, self._poll)
+
+    @property
+    def done(self):
+        return not self._futures
+
+    def _poll(self):
+        for future in [f for f in self._futures if f.done()]:
+            path = self._futures.pop(future)
+            try:
+                self.results[path] = future.result()
+            except Exception as e:
+                self.errors[path] = e
+        if self.on_progress:
+            self.on_progress(len(self.results) + len(self.errors), len(self.file_paths))
+        if self._futures:
+            self.widget.after(POLL_MS, self._poll)
+        elif self.on_done:
+            self.on_done(self.results, self.errors)
+
+    def cancel(self):
+        for future in self._futures:
+            future.cancel()
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+# مخزن صور بجانب قاعدة البيانات، والملفات مسمّاة بحسب بصمة محتواها (SHA-256):
+#   <قاعدة البيانات>_photos/ab/abcdef....jpg
+# الملف المكرر يُخزّن مرة واحدة مهما تكرر إرفاقه.
+
+HASH_CHUNK = 1024 * 1024
+# المعاينات المصغّرة المحفوظة (image_cache.DiskPreviewCache) داخل المخزن
+PREVIEW_DIR = "_previews"
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(HASH_CHUNK)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def image_size(file_path):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None, None
+    try:
+        # Image.open يقرأ الترويسة فقط، لا يفك ترميز الصورة كاملة
+        with Image.open(file_path) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+class PhotoStore:
+    def __init__(self, db_file=None, root=None):
+        self.root = root or os.path.splitext(os.path.abspath(db_file))[0] + "_photos"
+
+    @property
+    def preview_root(self):
+        return os.path.join(self.root, PREVIEW_DIR)
+
+    def path_for(self, file_hash, extension=""):
+        return os.path.join(self.root, file_hash[:2], file_hash + (extension or ""))
+
+    def exists(self, file_hash, extension=""):
+        return os.path.exists(self.path_for(file_hash, extension))
+
+    def _write_once(self, target, write):
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # الكتابة إلى ملف مؤقت ثم إعادة التسمية، فلا يظهر ملف ناقص أبداً
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                write(out)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _describe(self, file_hash, extension, original_name, size):
+        width, height = image_size(self.path_for(file_hash, extension))
+        return {
+            "Hash": file_hash,
+            "Extension": extension,
+            "OriginalName": original_name,
+            "Size": size,
+            "Width": width,
+            "Height": height,
+        }
+
+    def put_file(self, file_path):
+        """Copy a file into the store (once per content) and describe it."""
+        extension = os.path.splitext(file_path)[1].lower()
+        file_hash, size = hash_file(file_path)
+
+        def copy(out):
+            with open(file_path, "rb") as src:
+                shutil.copyfileobj(src, out, HASH_CHUNK)
+
+        self._write_once(self.path_for(file_hash, extension), copy)
+        return self._describe(file_hash, extension, os.path.basename(file_path), size)
+
+    def put_bytes(self, data, extension, original_name):
+        file_hash = hashlib.sha256(data).hexdigest()
+        self._write_once(self.path_for(file_hash, extension), lambda out: out.write(data))
+        return self._describe(file_hash, extension, original_name, len(data))
+
+    def open(self, file_hash, extension=""):
+        return open(self.path_for(file_hash, extension), "rb")
+
+    def remove(self, file_hash, extension=""):
+        path = self.path_for(file_hash, extension)
+        if os.path.exists(path):
+            self.remove_preview(path)
+            os.remove(path)
+
+    def remove_preview(self, path):
+        # مفتاح المعاينة من stat الملف، فتُحذف قبل حذفه
+        try:
+            from image_cache import PREVIEW_SIZE, DiskPreviewCache, cache_key
+        except ImportError:
+            return
+        DiskPreviewCache(self.preview_root).remove(cache_key(path, PREVIEW_SIZE))
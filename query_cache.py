@@ -0,0 +1,82 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# ذاكرة لنتائج الاستعلامات الكاملة (DataFrame مثلاً):
+#   - كل النتائج صالحة لرمز تغيّر واحد للقاعدة (utils.changeToken)؛ أي كتابة تُسقطها كلها
+#   - حد أقصى للبايتات، والأقدم استعمالاً يُطرد أولاً
+
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def estimate_size(value):
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """Read-through cache: get(key, token, load) returns the cached value while token is unchanged."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._token = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = self.evictions = self.too_large = 0
+
+    def get(self, key, token, load):
+        with self._lock:
+            if token != self._token:
+                if self._entries:
+                    self.invalidations += 1
+                self._clear()
+                self._token = token
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            self.misses += 1
+
+        # القراءة خارج القفل؛ الرمز أُخذ قبلها، فكتابة أثناء القراءة تُسقط النتيجة في الطلب التالي
+        value = load()
+        size = estimate_size(value)
+        with self._lock:
+            if size > self.max_bytes:
+                self.too_large += 1
+            elif token == self._token:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._bytes -= old[1]
+                self._entries[key] = (value, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, old_size) = self._entries.popitem(last=False)
+                    self._bytes -= old_size
+                    self.evictions += 1
+        return value
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "too_large": self.too_large,
+            }
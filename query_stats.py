@@ -0,0 +1,212 @@
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# قياس الاستعلامات في طبقة البيانات:
+#   - كل جملة SQL تُوقّت عبر TimedCursor في utils، وتُجمع حسب نصها
+#   - كل عملية عامة في Hospital و Appointment تُعدّ وتُوقّت عبر @instrument
+#   - الجمل البطيئة تُكتب في سجل دوّار، والمعاملات مخفية (النوع والطول فقط)
+# STATS.snapshot() يعطي الملخص، وواجهة المرضى تعرضه وتحفظه.
+
+SLOW_QUERY_MS = 200
+SLOW_LOG_FILE = "slow_queries.log"
+SLOW_LOG_BYTES = 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+LATENCY_SAMPLES = 200
+TOP_STATEMENTS = 20
+
+slow_log = logging.getLogger("register.slow_queries")
+slow_log.propagate = False
+
+_local = threading.local()
+
+
+def redact(value):
+    # لا يُكتب أي اسم أو رقم هاتف في السجل، فقط ما يكفي لإعادة إنتاج شكل الاستعلام
+    if value is None:
+        return "<null>"
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact_params(params, many=False):
+    if many:
+        return "<executemany>"
+    if isinstance(params, dict):
+        return {name: redact(value) for name, value in params.items()}
+    return [redact(value) for value in params or ()]
+
+
+# IN (?, ?, ...) بطول متغيّر (الدفعات، get_patients) جملة واحدة في الإحصاءات
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_key(sql):
+    return _IN_LIST.sub("IN (?, ...)", " ".join(sql.split()))
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    return ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def current_operation():
+    stack = getattr(_local, "operations", None)
+    return stack[-1] if stack else None
+
+
+class QueryStats:
+    """Thread-safe aggregates of SQL statements and data-layer operations."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}
+            self._operations = {}
+            self.slow = 0
+            self.started = time.time()
+
+    def record_statement(self, db_file, sql, params, many, seconds, rows):
+        ms = seconds * 1000
+        key = statement_key(sql)
+        operation = current_operation()
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0,
+                                                 "operations": set()}
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["rows"] += rows
+            if operation:
+                entry["operations"].add(operation)
+            slow = ms >= self.slow_ms
+            if slow:
+                self.slow += 1
+        if slow and slow_log.handlers:
+            slow_log.warning(json.dumps({
+                "db": db_file,
+                "operation": operation,
+                "ms": round(ms, 3),
+                "rows": rows,
+                "sql": key,
+                "params": redact_params(params, many),
+            }, ensure_ascii=False))
+
+    def record_operation(self, name, seconds, failed):
+        with self._lock:
+            entry = self._operations.get(name)
+            if entry is None:
+                entry = self._operations[name] = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                  "samples": deque(maxlen=LATENCY_SAMPLES)}
+            ms = seconds * 1000
+            entry["count"] += 1
+            entry["errors"] += failed
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["samples"].append(ms)
+
+    def snapshot(self, top=TOP_STATEMENTS):
+        """Plain dict (JSON-ready): the costliest statements and every operation."""
+        with self._lock:
+            statements = sorted(self._statements.items(), key=lambda item: item[1]["total_ms"], reverse=True)
+            operations = {}
+            for name, entry in sorted(self._operations.items()):
+                p50, p95 = _percentiles(entry["samples"])
+                operations[name] = {
+                    "count": entry["count"], "errors": entry["errors"],
+                    "total_ms": round(entry["total_ms"], 3), "max_ms": round(entry["max_ms"], 3),
+                    "p50_ms": round(p50, 3), "p95_ms": round(p95, 3),
+                }
+            return {
+                "since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+                "slow_ms": self.slow_ms,
+                "slow_statements": self.slow,
+                "statement_count": sum(entry["count"] for entry in self._statements.values()),
+                "statements": [{
+                    "sql": sql, "count": entry["count"], "total_ms": round(entry["total_ms"], 3),
+                    "mean_ms": round(entry["total_ms"] / entry["count"], 3), "max_ms": round(entry["max_ms"], 3),
+                    "rows": entry["rows"], "operations": sorted(entry["operations"]),
+                } for sql, entry in statements[:top]],
+                "operations": operations,
+            }
+
+
+STATS = QueryStats()
+
+
+def enable_slow_log(path=SLOW_LOG_FILE, threshold_ms=SLOW_QUERY_MS, max_bytes=SLOW_LOG_BYTES,
+                    backups=SLOW_LOG_BACKUPS, db_file=None):
+    """Write statements slower than threshold_ms to a rotating log, one JSON object per line.
+
+    With db_file, a relative path is taken from the database's directory instead of the working directory.
+    """
+    if db_file is not None:
+        path = os.path.join(os.path.dirname(os.path.abspath(db_file)), path)
+    STATS.slow_ms = threshold_ms
+    for handler in list(slow_log.handlers):
+        slow_log.removeHandler(handler)
+        handler.close()
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.WARNING)
+    return handler
+
+
+def instrument(cls):
+    """Class decorator: count and time every public method as the operation Class.method."""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_") or not callable(value) or isinstance(value, (staticmethod, classmethod, type)):
+            continue
+        setattr(cls, attr, _timed(f"{cls.__name__}.{attr}", value))
+    return cls
+
+
+def _timed(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, "operations", None)
+        if stack is None:
+            stack = _local.operations = []
+        stack.append(name)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            stack.pop()
+            STATS.record_operation(name, time.perf_counter() - started, failed)
+    return wrapper
+
+
+def format_report(snapshot, extra=None):
+    """Human-readable text of a snapshot, plus extra {title: dict} sections."""
+    lines = [f"منذ {snapshot['since']}: {snapshot['statement_count']} جملة، "
+             f"{snapshot['slow_statements']} أبطأ من {snapshot['slow_ms']} ms", "", "العمليات:"]
+    for name, entry in snapshot["operations"].items():
+        lines.append(f"  {name:<45} {entry['count']:>7} x  p50 {entry['p50_ms']:9.2f}  p95 {entry['p95_ms']:9.2f}"
+                     f"  max {entry['max_ms']:9.2f} ms  أخطاء {entry['errors']}")
+    lines += ["", "أكثر الجمل كلفة:"]
+    for entry in snapshot["statements"]:
+        lines.append(f"  {entry['total_ms']:10.2f} ms  {entry['count']:>7} x  max {entry['max_ms']:9.2f}"
+                     f"  rows {entry['rows']:>8}  {entry['sql'][:120]}")
+    for title, values in (extra or {}).items():
+        lines += ["", f"{title}:"]
+        lines += [f"  {key}: {value}" for key, value in (values or {}).items()]
+    return "\n".join(lines)
@@ -0,0 +1,127 @@
+from dataclasses import dataclass, fields
+
+# سجلات خفيفة للاستعلامات التفاعلية بدل DataFrame؛
+# pandas لا يُستورد إلا عند طلب إطار صراحةً (التحليل والتصدير)
+
+
+class _RecordAccess:
+    # توافق مع الشيفرة التي كانت تتعامل مع صفوف pandas
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def to_dict(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+
+@dataclass(slots=True)
+class PatientRecord(_RecordAccess):
+    ID: int
+    FirstName: str
+    LastName: str
+    Age: int
+    Gender: str
+    Contact: str = None
+    Photos: str = None
+    DateAdded: str = None
+    LastModified: str = None
+    Deleted: int = 0
+
+
+PATIENT_COLUMNS = ", ".join(f.name for f in fields(PatientRecord))
+
+
+@dataclass(slots=True)
+class PhotoRecord(_RecordAccess):
+    ID: int
+    PatientID: int
+    Hash: str
+    Extension: str
+    OriginalName: str = None
+    Size: int = None
+    Width: int = None
+    Height: int = None
+    Created: str = None
+
+
+PHOTO_COLUMNS = ", ".join(f.name for f in fields(PhotoRecord))
+
+
+@dataclass(slots=True)
+class AppointmentRecord(_RecordAccess):
+    ID: int
+    PatientID: int
+    AppointmentDate: str
+    Condition: str = None
+    Treatment: str = None
+    Symptoms: str = None
+    Notes: str = None
+    NextAppointment: str = None
+    DateAdded: str = None
+    LastModified: str = None
+    # الأعمدة القياسية: ISO-8601 وثوانٍ للفرز والمجالات الزمنية
+    AppointmentISO: str = None
+    AppointmentTs: int = None
+    NextAppointmentISO: str = None
+    NextAppointmentTs: int = None
+
+
+APPOINTMENT_COLUMNS = ", ".join(f.name for f in fields(AppointmentRecord))
+
+
+@dataclass(slots=True)
+class ScheduleEntry(_RecordAccess):
+    """One row of the day/week schedule: the appointment with its patient's name and contact."""
+    ID: int
+    PatientID: int
+    AppointmentISO: str
+    AppointmentTs: int
+    AppointmentDate: str
+    Condition: str = None
+    Treatment: str = None
+    NextAppointmentISO: str = None
+    FirstName: str = None
+    LastName: str = None
+    Contact: str = None
+
+    @property
+    def time(self):
+        # "" للمواعيد المسجلة بالتاريخ فقط
+        return self.AppointmentISO[11:16] if self.AppointmentISO else ""
+
+
+SCHEDULE_COLUMNS = ("a.ID, a.PatientID, a.AppointmentISO, a.AppointmentTs, a.AppointmentDate, a.Condition,"
+                    " a.Treatment, a.NextAppointmentISO, p.FirstName, p.LastName, p.Contact")
+
+
+@dataclass(slots=True)
+class FollowUp(_RecordAccess):
+    """A patient whose last visit asked for a follow-up, with the date it is due."""
+    PatientID: int
+    AppointmentID: int
+    LastVisitISO: str
+    DueISO: str
+    DueTs: int
+    FirstName: str = None
+    LastName: str = None
+    Contact: str = None
+
+
+FOLLOWUP_COLUMNS = "f.PatientID, f.AppointmentID, f.LastVisitISO, f.DueISO, f.DueTs, p.FirstName, p.LastName, p.Contact"
+
+
+def columns_of(record_type, alias=None):
+    """The SELECT list matching record_type's field order, optionally qualified by a table alias."""
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(prefix + f.name for f in fields(record_type))
+
+
+def records_frame(records, record_type):
+    """Build a DataFrame from records, for callers that opted in with as_frame=True."""
+    import pandas as pd
+    names = [f.name for f in fields(record_type)]
+    return pd.DataFrame([[getattr(record, name) for name in names] for record in records], columns=names)
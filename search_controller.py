@@ -0,0 +1,126 @@
+import queue
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import CancelToken, isInterrupted
+
+# بحث أثناء الكتابة دون تجميد الواجهة:
+#   - انتظار قصير بعد آخر ضغطة قبل إرسال الاستعلام
+#   - الاستعلام في خيط خلفي، والأقدم يُقاطع (sqlite3 interrupt) عند وصول نص أحدث
+#   - لا تُطبّق على الشجرة إلا نتيجة آخر نص، من خيط Tk عبر after()
+
+DEBOUNCE_MS = 250
+POLL_MS = 20
+LATENCY_SAMPLES = 200
+
+
+class SearchController:
+    """Debounce keystrokes and run run_query(term, cancel) on a worker thread.
+
+    apply_result(term, result) and on_error(term, error) are called on the Tk thread,
+    only for the most recent term.
+    """
+
+    def __init__(self, widget, run_query, apply_result, on_error=None, delay_ms=DEBOUNCE_MS):
+        self.widget = widget
+        self.run_query = run_query
+        self.apply_result = apply_result
+        self.on_error = on_error
+        self.delay_ms = delay_ms
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self._results = queue.Queue()
+        self._after_id = None
+        self._term = None
+        self._generation = 0
+        self._running = None
+        self._typed_at = None
+        self._polling = False
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.cancelled = 0
+
+    def on_key(self, term):
+        # مفاتيح لا تغيّر النص (الأسهم، Shift...) لا تعيد البحث
+        if term == self._term:
+            return
+        self._term = term
+        # الزمن يُحسب من آخر ضغطة، كما يشعر به المستخدم
+        self._typed_at = time.perf_counter()
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self._after_id = self.widget.after(self.delay_ms, self._start, term)
+
+    def search_now(self, term):
+        self._term = term
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self._typed_at = time.perf_counter()
+        self._start(term)
+
+    def _start(self, term):
+        self._after_id = None
+        if self._running is not None:
+            self._running.cancel()
+            self.cancelled += 1
+        self._generation += 1
+        cancel = self._running = CancelToken()
+        self._executor.submit(self._run, self._generation, term, cancel, self._typed_at)
+        if not self._polling:
+            self._polling = True
+            self.widget.after(POLL_MS, self._poll)
+
+    def _run(self, generation, term, cancel, typed_at):
+        # خيط خلفي: لا يلمس Tk
+        started = time.perf_counter()
+        result = error = None
+        if cancel.cancelled:
+            error = "cancelled"
+        else:
+            try:
+                result = self.run_query(term, cancel)
+            except Exception as e:
+                error = e
+        self._results.put((generation, term, result, error, typed_at, started, time.perf_counter()))
+
+    def _poll(self):
+        while True:
+            try:
+                generation, term, result, error, typed_at, started, finished = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation:
+                continue
+            self._running = None
+            if error is None:
+                self.apply_result(term, result)
+            elif not (error == "cancelled" or isInterrupted(error)) and self.on_error:
+                self.on_error(term, error)
+            now = time.perf_counter()
+            self.latencies.append({
+                "term": term,
+                "query_ms": (finished - started) * 1000,
+                "total_ms": (now - typed_at) * 1000,
+            })
+        if self._running is not None:
+            self.widget.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+    def stats(self):
+        """Latency of the applied searches: last, p50 and p95 in milliseconds."""
+        if not self.latencies:
+            return {"count": 0, "cancelled": self.cancelled}
+        totals = sorted(sample["total_ms"] for sample in self.latencies)
+        return {
+            "count": len(totals),
+            "cancelled": self.cancelled,
+            "last_ms": self.latencies[-1]["total_ms"],
+            "last_query_ms": self.latencies[-1]["query_ms"],
+            "p50_ms": totals[len(totals) // 2],
+            "p95_ms": totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+        }
+
+    def shutdown(self):
+        if self._running is not None:
+            self._running.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
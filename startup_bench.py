@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# قياس زمن الإقلاع لتتبّع التراجعات:
+#   1) زمن الاستيراد لوحدات الشاشة الأولى عبر python -X importtime
+#   2) زمن أول رسم للنافذة (يحتاج شاشة؛ يُتخطّى بدونها)
+# ويفشل إذا تجاوز الميزانية أو إذا استوردت الشاشة الأولى وحدة ثقيلة مؤجلة
+
+STARTUP_MODULES = ("main", "home1")
+# وحدات يجب ألا تُحمّل قبل أن يطلبها المستخدم
+LAZY_MODULES = ("pandas", "numpy", "PIL", "HospitalGui", "photo_ingest", "image_cache", "data_io")
+IMPORT_BUDGET_MS = 250
+FIRST_PAINT_BUDGET_MS = 1000
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_PAINT_SCRIPT = """
+import json, main
+app = main.App()
+app.update()
+print(json.dumps(app.first_paint_ms))
+main.shutdown(app)
+app.destroy()
+"""
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from the lines printed by -X importtime."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def measure_imports(modules=STARTUP_MODULES):
+    code = "import " + ", ".join(modules)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=HERE, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    entries = parse_importtime(result.stderr)
+    total_us = sum(cumulative for _, _, cumulative, depth in entries if depth == 0)
+    return total_us / 1000, entries
+
+
+def measure_first_paint():
+    # عملية جديدة في كل مرة، حتى لا تُخفي ذاكرة الاستيراد التكلفة الحقيقية
+    result = subprocess.run([sys.executable, "-c", FIRST_PAINT_SCRIPT],
+                            cwd=HERE, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup time benchmark for the clinic application")
+    parser.add_argument("--runs", type=int, default=5, help="repeat and keep the best time")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--paint-budget-ms", type=float, default=FIRST_PAINT_BUDGET_MS)
+    parser.add_argument("--json", action="store_true", help="print a JSON report only")
+    args = parser.parse_args(argv)
+
+    runs = [measure_imports() for _ in range(max(1, args.runs))]
+    import_ms, entries = min(runs, key=lambda run: run[0])
+    eager = sorted({name.split(".")[0] for name, _, _, _ in entries} & set(LAZY_MODULES))
+    slowest = sorted(entries, key=lambda entry: entry[1], reverse=True)[:args.top]
+    paints = [ms for ms in (measure_first_paint() for _ in range(max(1, args.runs))) if ms is not None]
+    paint_ms = min(paints) if paints else None
+
+    report = {
+        "import_ms": round(import_ms, 1),
+        "first_paint_ms": None if paint_ms is None else round(paint_ms, 1),
+        "eager_heavy_modules": eager,
+        "slowest_imports": [{"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative / 1000}
+                            for name, self_us, cumulative, _ in slowest],
+    }
+    ok = (import_ms <= args.import_budget_ms and not eager
+          and (paint_ms is None or paint_ms <= args.paint_budget_ms))
+    report["ok"] = ok
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"الاستيراد: {import_ms:.1f} ms (الميزانية {args.import_budget_ms:.0f} ms)")
+        if paint_ms is None:
+            print("أول رسم: غير مقاس (لا توجد شاشة)")
+        else:
+            print(f"أول رسم: {paint_ms:.1f} ms (الميزانية {args.paint_budget_ms:.0f} ms)")
+        if eager:
+            print("وحدات ثقيلة مستوردة مبكراً: " + ", ".join(eager))
+        print("أبطأ الاستيرادات (ذاتي / تراكمي):")
+        for name, self_us, cumulative, _ in slowest:
+            print(f"  {self_us / 1000:8.1f} {cumulative / 1000:8.1f}  {name}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,386 @@
+import calendar
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
 
-def connectToDb(fileName):
-    conn = sqlite3.connect(fileName)
-    return conn ,conn.cursor()
-    
\ No newline at end of file
+from query_stats import STATS
+
+# إعدادات الاتصال: تطبق مرة واحدة عند إنشاء كل اتصال طويل العمر
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",        # ~16MB لكل اتصال
+    "PRAGMA mmap_size = 268435456",      # 256MB
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+READERS_PER_DB = 4
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's time (execute plus fetches) and row count to STATS.
+
+    A statement is recorded once its rows are exhausted, or at the next execute or close().
+    """
+
+    _statement = None
+
+    def _run(self, method, sql, parameters, many):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(self, sql, parameters)
+        finally:
+            self._statement = [sql, parameters, many, time.perf_counter() - started, 0]
+
+    def execute(self, sql, parameters=()):
+        return self._run(sqlite3.Cursor.execute, sql, parameters, False)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(sqlite3.Cursor.executemany, sql, seq_of_parameters, True)
+
+    def _fetched(self, started, rows, exhausted):
+        if self._statement is not None:
+            self._statement[3] += time.perf_counter() - started
+            self._statement[4] += rows
+            if exhausted:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        sql, parameters, many, seconds, rows = statement
+        pool = getattr(self.connection, "pool", None)
+        # في جمل الكتابة لا صفوف مجلوبة، فالعدد هو الصفوف المتأثرة
+        STATS.record_statement(pool.fileName if pool else None, sql, parameters, many, seconds,
+                               rows or max(self.rowcount, 0))
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool; its cursors are timed."""
+
+    pool = None
+    readonly = False
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    """Long-lived connections for one database file: one writer, a few readers."""
+
+    def __init__(self, fileName, readers=READERS_PER_DB):
+        self.fileName = fileName
+        self.max_readers = readers
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._writer_depth = 0
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._closed = False
+        # عدد المعاملات المحفوظة عبر اتصال الكتابة، واتصال مستقل لقراءة data_version
+        self.writes = 0
+        self._watch = None
+        self._watch_lock = threading.Lock()
+
+    def _open(self, readonly):
+        conn = sqlite3.connect(self.fileName, factory=PooledConnection,
+                               check_same_thread=False)
+        if not readonly:
+            # WAL محفوظ في الملف نفسه، يكفي تفعيله من اتصال الكتابة
+            conn.execute("PRAGMA journal_mode = WAL")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only = 1")
+        conn.pool = self
+        conn.readonly = readonly
+        return conn
+
+    def acquire(self, readonly=False):
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"pool for {self.fileName} is closed")
+        if not readonly:
+            # اتصال كتابة واحد؛ إعادة الدخول من نفس الخيط تعيد نفس الاتصال
+            self._writer_lock.acquire()
+            if self._writer is None:
+                try:
+                    self._writer = self._open(readonly=False)
+                except Exception:
+                    self._writer_lock.release()
+                    raise
+            self._writer_depth += 1
+            return self._writer
+
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._open(readonly=True)
+            except Exception:
+                with self._reader_lock:
+                    self._reader_count -= 1
+                raise
+        return self._readers.get()
+
+    def release(self, conn):
+        if conn.readonly:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.really_close()
+            else:
+                self._readers.put(conn)
+            return
+        self._writer_depth -= 1
+        if self._writer_depth == 0 and conn.in_transaction:
+            # ما لم يُحفظ صراحةً لا ينتقل إلى المستخدم التالي للاتصال
+            conn.rollback()
+        self._writer_lock.release()
+
+    def change_token(self):
+        """A value that changes whenever anything commits to the file, here or in another process.
+
+        PRAGMA data_version only moves for commits made by other connections, so it is read on
+        a connection that never writes; the write counter covers this pool without a query.
+        """
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = self._open(readonly=True)
+            version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        return version, self.writes
+
+    def close(self):
+        self._closed = True
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.really_close()
+                self._watch = None
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.really_close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().really_close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def getPool(fileName):
+    key = os.path.abspath(fileName)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(key)
+        return pool
+
+
+def connectToDb(fileName, readonly=False):
+    conn = getPool(fileName).acquire(readonly)
+    return conn, conn.cursor()
+
+
+class DataError(Exception):
+    """A data-layer failure: message is meant for the user, operation names the failing call."""
+
+    def __init__(self, message, operation=None):
+        super().__init__(message)
+        self.message = message
+        self.operation = operation
+
+    @property
+    def cause(self):
+        return self.__cause__
+
+
+class CancelToken:
+    """Interrupts the queries of every dbSession opened with it, from any thread."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for conn in self._connections:
+                conn.interrupt()
+
+    def register(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise sqlite3.OperationalError("interrupted")
+            self._connections.add(conn)
+
+    def unregister(self, conn):
+        # قبل إعادة الاتصال إلى المجمع، حتى لا يُقاطع مستخدمه التالي
+        with self._lock:
+            self._connections.discard(conn)
+
+
+def isInterrupted(error):
+    # يشمل DataError الذي يغلّف خطأ المقاطعة
+    while error is not None:
+        if isinstance(error, sqlite3.OperationalError) and "interrupted" in str(error):
+            return True
+        error = error.__cause__
+    return False
+
+
+@contextmanager
+def dbSession(fileName, readonly=False, cancel=None):
+    # يحفظ عند النجاح، يتراجع عند الخطأ، ويعيد الاتصال إلى المجمع دائماً
+    conn, cursor = connectToDb(fileName, readonly)
+    try:
+        if cancel is not None:
+            cancel.register(conn)
+        try:
+            yield conn, cursor
+            if not readonly:
+                conn.commit()
+                # ما زال اتصال الكتابة محجوزاً لهذا الخيط، فالزيادة آمنة
+                conn.pool.writes += 1
+        finally:
+            if cancel is not None:
+                cancel.unregister(conn)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def changeToken(fileName):
+    return getPool(fileName).change_token()
+
+
+def closeAllDbs():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+# ------------------ التواريخ ------------------
+# كل الصيغ التي كتبها البرنامج أو المستخدمون في AppointmentDate و NextAppointment.
+# الشكل القياسي: ISO-8601 (YYYY-MM-DD أو YYYY-MM-DDTHH:MM) وعدد ثوانٍ للفهرسة والمقارنة.
+# الثواني تمثل الوقت المحلي كما كُتب (تُحسب كأنه UTC)، فلا يتأثر الترتيب بالتوقيت الصيفي.
+DATETIME_FORMATS = (
+    "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %I:%M %p", "%Y/%m/%d %H:%M", "%d/%m/%Y %H:%M", "%d-%m-%Y %H:%M",
+)
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y")
+
+
+def parseDateTime(value):
+    """(datetime, has_time) for a stored date in any known format, (None, False) if it cannot be read."""
+    if value is None:
+        return None, False
+    if isinstance(value, datetime):
+        return value, True
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day), False
+    text = " ".join(str(value).translate(_DIGITS).replace("ص", "AM").replace("م", "PM").split())
+    if not text:
+        return None, False
+    # أجزاء الثانية والمنطقة الزمنية لا تهم موعداً في العيادة
+    if text[:4].isdigit() and "." in text:
+        text = text.split(".")[0]
+    for pattern in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(text, pattern), True
+        except ValueError:
+            pass
+    for pattern in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, pattern), False
+        except ValueError:
+            pass
+    return None, False
+
+
+def canonicalDateTime(value):
+    """(iso, epoch) for a stored date, (None, None) when it cannot be parsed."""
+    parsed, has_time = parseDateTime(value)
+    if parsed is None:
+        return None, None
+    iso = parsed.strftime("%Y-%m-%dT%H:%M" if has_time else "%Y-%m-%d")
+    return iso, calendar.timegm(parsed.replace(second=0, microsecond=0).timetuple())
+
+
+def epochOf(value):
+    """Epoch seconds of a date/datetime/str boundary, in the same wall-clock scale as the stored columns."""
+    return canonicalDateTime(value)[1]
+
+
+# ------------------ أرقام الهاتف ------------------
+# الشكل القياسي: أرقام لاتينية فقط، والرقم الدولي لبلد العيادة يُكتب بصيغته المحلية (0...)
+DEFAULT_COUNTRY_CODE = "213"
+_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+
+
+def normalizeContact(contact):
+    if contact is None:
+        return None
+    text = str(contact).strip().translate(_DIGITS)
+    digits = "".join(ch for ch in text if ch.isdigit())
+    if not digits:
+        return None
+    if text.startswith("+"):
+        digits = "00" + digits
+    if digits.startswith("00" + DEFAULT_COUNTRY_CODE):
+        digits = "0" + digits[2 + len(DEFAULT_COUNTRY_CODE):]
+    return digits
@@ -0,0 +1,332 @@
+import heapq
+from tkinter import ttk
+
+# قائمة افتراضية فوق ttk.Treeview:
+#   - كل الصفوف المحمّلة تبقى في نموذج بايثون خفيف (قائمة tuples)
+#   - الشجرة لا تحتوي إلا النافذة الظاهرة وبضعة صفوف احتياطية
+#   - شريط التمرير يمثل النموذج كله، والدفعات التالية تُجلب عند الاقتراب من النهاية
+
+OVERSCAN = 10      # صفوف إضافية تحت النافذة الظاهرة
+PREFETCH = 100     # نجلب الدفعة التالية قبل الوصول إلى آخر صف محمّل بهذا القدر
+LOAD_ALL_BATCH = 5000  # حجم الدفعة عند الحاجة إلى كل الصفوف (الفرز، End)
+
+
+class VirtualTree:
+    """Render a window of a Python row model into a Treeview.
+
+    fetch_page(token, limit, done) starts loading a page and later calls done(rows, next_token)
+    on the Tk thread; rows are tuples whose first item is the row id, rows=None means it failed.
+    render_row(row, index, checked) -> the values tuple shown for that row.
+    order_key(row) gives the order pages arrive in; changed rows are merged by it.
+    """
+
+    def __init__(self, tree, scrollbar, fetch_page, render_row, page_size=100, order_key=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.fetch_page = fetch_page
+        self.render_row = render_row
+        self.page_size = page_size
+        self.order_key = order_key
+        self._sort_key = None
+        self.rows = []
+        self.index = {}
+        self.checked = set()
+        self.selected_id = None
+        self.next_token = None
+        self.total = None
+        self.offset = 0
+        self.sort_column = None
+        self.sort_reverse = False
+        self._rendering = False
+        self._visible = None
+        self._generation = 0
+        self._loading = False
+        self._waiting = None
+
+        scrollbar.configure(command=self.yview)
+        tree.configure(yscrollcommand=lambda first, last: None)
+        tree.bind("<MouseWheel>", self.on_wheel)
+        tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        tree.bind("<Button-5>", lambda e: self.scroll(3))
+        tree.bind("<Up>", lambda e: self.move_selection(-1))
+        tree.bind("<Down>", lambda e: self.move_selection(1))
+        tree.bind("<Prior>", lambda e: self.move_selection(-self.visible_rows()))
+        tree.bind("<Next>", lambda e: self.move_selection(self.visible_rows()))
+        tree.bind("<Home>", lambda e: self.move_selection(-len(self.rows)))
+        tree.bind("<End>", lambda e: self.select_last())
+        tree.bind("<Configure>", self.on_resize, add="+")
+
+    # ------------------ النموذج ------------------
+
+    def reset(self, total=None, first_page=None):
+        """Drop the model and load the first page; total sizes the scrollbar when known.
+
+        first_page=(rows, next_token) installs a page that was already fetched elsewhere.
+        """
+        self.rows = []
+        self.index = {}
+        self.checked.clear()
+        self.selected_id = None
+        self.next_token = None
+        self.total = total
+        self.offset = 0
+        self.sort_column = None
+        self.sort_reverse = False
+        self._sort_key = None
+        # ما يصل من تحميل سابق لهذه القائمة يُهمل
+        self._generation += 1
+        self._loading = False
+        self._waiting = None
+        if first_page is None:
+            self._waiting = [self.page_size, []]
+            self._request()
+        else:
+            rows, self.next_token = first_page
+            self._append(rows)
+        self.render()
+
+    def _append(self, rows):
+        for row in rows:
+            if row[0] not in self.index:
+                self.index[row[0]] = len(self.rows)
+                self.rows.append(row)
+
+    def _reindex(self):
+        self.index = {row[0]: i for i, row in enumerate(self.rows)}
+
+    def load(self, count, then=None):
+        """Make sure count rows are loaded (None: all of them), then call then() or re-render.
+
+        Returns True when the rows were already there and then() ran immediately.
+        """
+        if self.next_token is None or (count is not None and len(self.rows) >= count):
+            if then:
+                then()
+            return True
+        if self._waiting is None:
+            self._waiting = [count, []]
+        elif count is None or self._waiting[0] is None:
+            self._waiting[0] = None
+        else:
+            self._waiting[0] = max(self._waiting[0], count)
+        if then:
+            self._waiting[1].append(then)
+        if not self._loading:
+            self._request()
+        return False
+
+    def _request(self):
+        count = self._waiting[0]
+        if count is None:
+            wanted = max(self.page_size, LOAD_ALL_BATCH)
+        else:
+            wanted = max(self.page_size, count - len(self.rows))
+        generation = self._generation
+        self._loading = True
+        self.fetch_page(self.next_token, wanted,
+                        lambda rows, token: self._loaded(generation, rows, token))
+
+    def _loaded(self, generation, rows, token):
+        if generation != self._generation:
+            return
+        self._loading = False
+        if rows is None:
+            # فشل الجلب؛ التمرير التالي يعيد المحاولة
+            self._waiting = None
+            return
+        self.next_token = token
+        self._append(rows)
+        count, thens = self._waiting
+        if token is not None and rows and (count is None or len(self.rows) < count):
+            self._request()
+            return
+        self._waiting = None
+        for then in thens:
+            then()
+        if not thens:
+            self.render()
+
+    def row_count(self):
+        # قبل اكتمال التحميل نستعمل العدد الكلي المعروف لحجم شريط التمرير
+        count = len(self.rows)
+        if self.next_token is not None:
+            count = max(count + self.page_size, self.total or 0)
+        return count
+
+    def sort(self, column, key=None):
+        """Sort the whole model by a row position; a second click on the same column reverses it."""
+        self.sort_reverse = not self.sort_reverse if self.sort_column == column else False
+        self.sort_column = column
+        self.load(None, lambda: self._sort(column, key))
+
+    def _sort(self, column, key):
+        key = key or (lambda row: (row[column] is None, row[column]))
+        try:
+            self.rows.sort(key=key, reverse=self.sort_reverse)
+        except TypeError:
+            key = lambda row: str(row[column])
+            self.rows.sort(key=key, reverse=self.sort_reverse)
+        self._sort_key = key
+        self._reindex()
+        self.offset = 0
+        self.render()
+
+    def apply_changes(self, rows, removed_ids=(), accept_new=True):
+        """Patch the model with changed rows and re-render once.
+
+        Known rows are replaced in place, removed_ids are dropped, and unknown rows are merged
+        in at their place in the current order (or skipped when accept_new is false).
+        """
+        removed = set(removed_ids) & self.index.keys()
+        if removed:
+            self.rows = [row for row in self.rows if row[0] not in removed]
+            self._reindex()
+            self.checked -= removed
+            if self.selected_id in removed:
+                self.selected_id = None
+
+        new_rows = []
+        key = self._sort_key or self.order_key
+        for row in rows:
+            i = self.index.get(row[0])
+            if i is not None:
+                self.rows[i] = row
+            elif accept_new:
+                # صف يقع بعد آخر صف محمّل سيصل مع الدفعات التالية
+                if (self.next_token is not None and self.rows and key
+                        and key(row) > key(self.rows[-1])):
+                    continue
+                new_rows.append(row)
+
+        if new_rows:
+            if key is None:
+                self.rows[:0] = new_rows
+            else:
+                reverse = self.sort_reverse if self._sort_key else False
+                new_rows.sort(key=key, reverse=reverse)
+                self.rows = list(heapq.merge(self.rows, new_rows, key=key, reverse=reverse))
+            self._reindex()
+        if self.total is not None:
+            self.total = max(0, self.total + len(new_rows) - len(removed))
+        self.render()
+
+    # ------------------ العرض ------------------
+
+    def visible_rows(self):
+        if self._visible is None:
+            style = ttk.Style(self.tree)
+            row_height = int(style.lookup("Treeview", "rowheight") or 20)
+            height = self.tree.winfo_height()
+            if height <= 1:
+                height = int(self.tree.cget("height")) * row_height
+            self._visible = max(1, height // row_height - 1)
+        return self._visible
+
+    def on_resize(self, event=None):
+        visible = self._visible
+        self._visible = None
+        if self.visible_rows() != visible:
+            self.render()
+
+    def render(self):
+        window = self.visible_rows() + OVERSCAN
+        if not self._loading and self.offset + window + PREFETCH > len(self.rows):
+            # الصفوف الظاهرة تُعرض الآن، والدفعة التالية تصل في الخلفية
+            self.load(self.offset + window + PREFETCH)
+        self.offset = max(0, min(self.offset, len(self.rows) - self.visible_rows()))
+
+        self._rendering = True
+        try:
+            self.tree.delete(*self.tree.get_children())
+            for i in range(self.offset, min(self.offset + window, len(self.rows))):
+                row = self.rows[i]
+                self.tree.insert("", "end", iid=str(row[0]),
+                                 values=self.render_row(row, i, row[0] in self.checked),
+                                 tags=('evenrow' if i % 2 == 0 else 'oddrow',))
+            if self.selected_id is not None and self.tree.exists(str(self.selected_id)):
+                self.tree.selection_set(str(self.selected_id))
+                self.tree.focus(str(self.selected_id))
+            self.tree.yview_moveto(0)
+        finally:
+            self._rendering = False
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        count = self.row_count()
+        if not count:
+            self.scrollbar.set(0, 1)
+            return
+        self.scrollbar.set(self.offset / count, min(1.0, (self.offset + self.visible_rows()) / count))
+
+    # ------------------ التمرير والتحديد ------------------
+
+    def scroll_to(self, offset):
+        offset = max(0, int(offset))
+        self.load(offset + self.visible_rows(), lambda: self._show_at(offset))
+
+    def _show_at(self, offset):
+        self.offset = offset
+        self.render()
+
+    def scroll(self, delta):
+        self.scroll_to(self.offset + delta)
+        return "break"
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * self.row_count())
+        elif args[0] == "scroll":
+            step = self.visible_rows() if args[2] == "pages" else 1
+            self.scroll(int(args[1]) * step)
+
+    def on_wheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def sync_selection(self):
+        """Call from <<TreeviewSelect>>; returns the selected row id, surviving re-renders."""
+        if self._rendering:
+            return self.selected_id
+        selected = self.tree.selection()
+        if selected:
+            self.selected_id = self.rows[self.index[self._key(selected[0])]][0]
+        elif self.selected_id is not None and self.tree.exists(str(self.selected_id)):
+            self.selected_id = None
+        return self.selected_id
+
+    def _key(self, iid):
+        for key in (iid, int(iid) if iid.lstrip("-").isdigit() else iid):
+            if key in self.index:
+                return key
+        raise KeyError(iid)
+
+    def move_selection(self, delta):
+        if not self.rows:
+            return "break"
+        target = self.index.get(self.selected_id, self.offset) + delta
+        self.load(target + 1, lambda: self._select_index(target))
+        return "break"
+
+    def select_last(self):
+        self.load(None, lambda: self._select_index(len(self.rows) - 1))
+        return "break"
+
+    def _select_index(self, target):
+        if not self.rows:
+            return
+        target = max(0, min(target, len(self.rows) - 1))
+        self.selected_id = self.rows[target][0]
+        if target < self.offset:
+            self.offset = target
+        elif target >= self.offset + self.visible_rows():
+            self.offset = target - self.visible_rows() + 1
+        self.render()
+        self.tree.event_generate("<<TreeviewSelect>>")
+
+    def toggle_checked(self, iid):
+        row = self.rows[self.index[self._key(iid)]]
+        if row[0] in self.checked:
+            self.checked.discard(row[0])
+        else:
+            self.checked.add(row[0])
+        i = self.index[row[0]]
+        self.tree.item(iid, values=self.render_row(row, i, row[0] in self.checked))